@@ -2,12 +2,17 @@ import pandas as pd
 import numpy as np
 import wget
 import os
+import hashlib
+import json
+import glob
+import contextlib
+from concurrent.futures import ProcessPoolExecutor,as_completed
 
 from datetime import datetime
 
 from ortools.linear_solver import pywraplp
+from ortools.linear_solver import linear_solver_pb2
 
-import itertools
 
 import ipywidgets as widgets
 from IPython.display import display, HTML
@@ -15,6 +20,473 @@ from IPython.display import display, HTML
 from tqdm import tqdm
 import sys
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+class ColumnarCache:
+    """Content addressed cache of data frames read by readData.
+
+    Entries are Arrow IPC files named by the sha256 of the source file
+    contents and the read options, so they are invalidated whenever either
+    changes. Files are memory mapped when opened. The directory is kept
+    below maxBytes by removing the least recently used entries.
+    """
+
+    formatVersion = 2
+
+    def __init__(self,directory,maxBytes=20*2**30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(self.directory,exist_ok=True)
+        self.hashIndexFile = os.path.join(self.directory,"hashIndex.json")
+
+    def fileHash(self,filename,blockSize=2**24):
+        #Hashing large files is slow, so remember the hash as long as size and modification time are unchanged
+        stat = os.stat(filename)
+        path = os.path.abspath(filename)
+        try:
+            with open(self.hashIndexFile) as file:
+                hashIndex = json.load(file)
+        except (OSError,ValueError):
+            hashIndex = dict()
+        if path in hashIndex and hashIndex[path][:2] == [stat.st_size,stat.st_mtime_ns]:
+            return hashIndex[path][2]
+        contentHash = hashlib.sha256()
+        with open(filename,"rb") as file:
+            for block in iter(lambda: file.read(blockSize),b""):
+                contentHash.update(block)
+        hashIndex[path] = [stat.st_size,stat.st_mtime_ns,contentHash.hexdigest()]
+        with open(self.hashIndexFile,"w") as file:
+            json.dump(hashIndex,file)
+        return hashIndex[path][2]
+
+    def key(self,filename,options):
+        keyHash = hashlib.sha256(self.fileHash(filename).encode())
+        keyHash.update(repr((self.formatVersion,sorted(options.items()))).encode())
+        return keyHash.hexdigest()
+
+    def path(self,key):
+        return os.path.join(self.directory,key+".arrow")
+
+    def load(self,key):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return None
+        # Mark as recently used for eviction
+        os.utime(path)
+        table = pa.ipc.open_file(pa.memory_map(path,"r")).read_all()
+        return table.to_pandas(split_blocks=True)
+
+    def store(self,key,frame):
+        self.storeChunks(key,[frame])
+
+    def storeChunks(self,key,chunks):
+        """Write data frames with the same columns one after another into one entry."""
+        path = self.path(key)
+        with pa.OSFile(path+".tmp","wb") as sink:
+            writer = None
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk,preserve_index=False)
+                if writer is None:
+                    # Categorical columns are stored dictionary encoded, with room for new labels in later chunks
+                    schema = pa.schema([field.with_type(pa.dictionary(pa.int32(),field.type.value_type))
+                                        if pa.types.is_dictionary(field.type) else field for field in table.schema])
+                    writer = pa.ipc.new_file(sink,schema,options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+                writer.write_table(table.cast(schema))
+            writer.close()
+        os.replace(path+".tmp",path)
+        self.evict(keep=path)
+
+    def evict(self,keep=None):
+        entries = [os.path.join(self.directory,name) for name in os.listdir(self.directory) if name.endswith(".arrow")]
+        entries.sort(key=lambda path: os.stat(path).st_mtime)
+        totalSize = sum(os.path.getsize(path) for path in entries)
+        for path in entries:
+            if totalSize <= self.maxBytes:
+                break
+            if path != keep:
+                totalSize -= os.path.getsize(path)
+                os.remove(path)
+
+
+class LazyFrame:
+    """Data stored in a memory mapped Arrow IPC file, for data larger than memory.
+
+    Stored columns are only read from disk when they are accessed. Derived
+    columns are functions (data,rows) -> values, evaluated only for the
+    requested row positions (all rows if rows is None). Assigning a function
+    to a column adds a derived column, assigning values keeps them in memory.
+    """
+
+    def __init__(self,path):
+        self.path = path
+        paths = [path] if isinstance(path,str) else path
+        self.table = pa.concat_tables([pa.ipc.open_file(pa.memory_map(path,"r")).read_all() for path in paths],
+                                      promote_options="default")
+        self.derived = dict()
+
+    @property
+    def columns(self):
+        return pd.Index(self.table.column_names+[colname for colname in self.derived.keys() if colname not in self.table.column_names])
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __contains__(self,colname):
+        return colname in self.derived or colname in self.table.column_names
+
+    def column(self,colname,rows=None):
+        """Values of a column as numpy array, only at the row positions rows if given."""
+        if colname in self.derived:
+            return np.asarray(self.derived[colname](self,rows))
+        column = self.table.column(colname)
+        if rows is not None:
+            column = column.take(pa.array(rows))
+        return column.to_numpy()
+
+    def codes(self,colname,rows=None):
+        """Integer codes and labels of a label column, without building an array of label strings."""
+        if colname in self.derived or not pa.types.is_dictionary(self.table.schema.field(colname).type):
+            codes,labels = pd.factorize(self.column(colname,rows))
+            return codes,pd.Index(labels)
+        column = self.table.column(colname)
+        if rows is not None:
+            column = column.take(pa.array(rows))
+        column = column.unify_dictionaries().combine_chunks()
+        return column.indices.to_numpy(zero_copy_only=False).astype(np.int64),pd.Index(column.dictionary.to_numpy(zero_copy_only=False))
+
+    def __getitem__(self,colname):
+        return pd.Series(self.column(colname),name=colname)
+
+    def __setitem__(self,colname,values):
+        if not callable(values):
+            values = np.asarray(values)
+            function = lambda data,rows: values if rows is None else values[rows]
+        else:
+            function = values
+        self.derived[colname] = function
+
+    def head(self,n=5):
+        rows = np.arange(min(n,len(self)))
+        return pd.DataFrame({colname:self.column(colname,rows) for colname in self.columns})
+
+    def isFloat(self,colname):
+        if colname in self.table.column_names and colname not in self.derived:
+            return pa.types.is_floating(self.table.schema.field(colname).type)
+        return True
+
+
+class SolverConfig:
+    """Solver backend and parameters used for every solve.
+
+    backend is a pywraplp solver id such as "CLP", "GLOP", "PDLP", "HIGHS",
+    "CPLEX" or "GUROBI_LP". algorithm is "primal", "dual" or "barrier",
+    presolve and scaling are True or False, timeLimit is in seconds and
+    specificParameters is passed to the backend as a string in its own
+    format (e.g. PDLP termination criteria). None keeps the solver default.
+    """
+
+    algorithms = {"primal":pywraplp.MPSolverParameters.PRIMAL,
+                  "dual":pywraplp.MPSolverParameters.DUAL,
+                  "barrier":pywraplp.MPSolverParameters.BARRIER}
+    # Backends that continue from the basis of the previous solve in incremental solves
+    warmStartBackends = {"GLOP":True}
+    # Incremental CLP solves after changes of the objective and the bounds return wrong optima,
+    # see tests/test_warm_start.py, so CLP always solves from scratch
+    unsafeWarmStartBackends = ["CLP"]
+    # Backends that ignore INCREMENTALITY_OFF and keep the basis of the previous solve
+    coldSolveCopyBackends = ["GLOP"]
+    # Backends whose iteration count pywraplp reports, e.g. HiGHS always reports 0
+    iterationBackends = ["CLP","GLOP","PDLP","SCIP","CPLEX_LP","GUROBI_LP","XPRESS_LP"]
+
+    def __init__(self,backend="CLP",threads=None,presolve=None,algorithm=None,primalTolerance=None,
+                 dualTolerance=None,scaling=None,timeLimit=None,specificParameters=""):
+        self.backend = backend
+        self.threads = threads
+        self.presolve = presolve
+        self.algorithm = algorithm
+        self.primalTolerance = primalTolerance
+        self.dualTolerance = dualTolerance
+        self.scaling = scaling
+        self.timeLimit = timeLimit
+        self.specificParameters = specificParameters
+
+    def createSolver(self):
+        """New pywraplp solver for the backend, ValueError if it is not available."""
+        solver = pywraplp.Solver.CreateSolver(self.backend)
+        if solver is None:
+            raise ValueError("Solver backend "+self.backend+" is not available in this OR-Tools installation")
+        if self.threads is not None and not solver.SetNumThreads(self.threads):
+            display("Solver "+self.backend+" does not support setting the number of threads")
+        if self.timeLimit is not None:
+            solver.SetTimeLimit(int(self.timeLimit*1000))
+        if len(self.specificParameters) > 0:
+            solver.SetSolverSpecificParametersAsString(self.specificParameters)
+        return solver
+
+    def warmStarts(self,warmStart=None):
+        """Whether solves continue from the previous basis: warmStart if the backend supports it safely,
+        by default for the backends of warmStartBackends."""
+        if warmStart and self.backend in self.unsafeWarmStartBackends:
+            display("Warm starts are not used with "+self.backend+", its incremental solves can return wrong optima")
+            return False
+        if self.backend not in self.warmStartBackends:
+            return False
+        return self.warmStartBackends[self.backend] if warmStart is None else warmStart
+
+    def iterations(self,solver):
+        """Iterations of the last solve, NaN if the backend does not report them."""
+        if self.backend not in self.iterationBackends or solver.iterations() < 0:
+            return np.nan
+        return solver.iterations()
+
+    def solve(self,solver,warmStart=False):
+        """Solve with the parameters, from the basis of the previous solve only with warmStart.
+        Returns the status and the iterations.
+
+        The backends of coldSolveCopyBackends keep their basis even with INCREMENTALITY_OFF.
+        Their cold solves are done by a new solver on a copy of the model, and the solution
+        is loaded back into solver.
+        """
+        if warmStart or self.backend not in self.coldSolveCopyBackends:
+            res = solver.Solve(self.parameters(incremental=warmStart))
+            return res,self.iterations(solver)
+        model = linear_solver_pb2.MPModelProto()
+        solver.ExportModelToProto(model)
+        with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+            copy = self.createSolver()
+        copy.LoadModelFromProto(model)
+        res = copy.Solve(self.parameters(incremental=False))
+        if res in [pywraplp.Solver.OPTIMAL,pywraplp.Solver.FEASIBLE]:
+            response = linear_solver_pb2.MPSolutionResponse()
+            copy.FillSolutionResponseProto(response)
+            #Free rows are left out of the copy, their duals are zero
+            duals = iter(list(response.dual_value))
+            response.ClearField("dual_value")
+            response.dual_value.extend([0.0 if row.lower_bound <= -solver.infinity() and row.upper_bound >= solver.infinity()
+                                        else next(duals) for row in model.constraint])
+            solver.LoadSolutionFromProto(response)
+        return res,self.iterations(copy)
+
+    def parameters(self,incremental=True):
+        """MPSolverParameters given to Solve(). An incremental solve keeps the solver and its basis from the previous solve."""
+        parameters = pywraplp.MPSolverParameters()
+        parameters.SetIntegerParam(parameters.INCREMENTALITY,parameters.INCREMENTALITY_ON if incremental else parameters.INCREMENTALITY_OFF)
+        if self.presolve is not None:
+            parameters.SetIntegerParam(parameters.PRESOLVE,parameters.PRESOLVE_ON if self.presolve else parameters.PRESOLVE_OFF)
+        if self.scaling is not None:
+            parameters.SetIntegerParam(parameters.SCALING,parameters.SCALING_ON if self.scaling else parameters.SCALING_OFF)
+        if self.algorithm is not None:
+            parameters.SetIntegerParam(parameters.LP_ALGORITHM,self.algorithms[self.algorithm])
+        if self.primalTolerance is not None:
+            parameters.SetDoubleParam(parameters.PRIMAL_TOLERANCE,self.primalTolerance)
+        if self.dualTolerance is not None:
+            parameters.SetDoubleParam(parameters.DUAL_TOLERANCE,self.dualTolerance)
+        return parameters
+
+
+class ColumnLookup:
+    """Mapping of column names to values, given to derived column functions."""
+
+    def __init__(self,column):
+        self.column = column
+
+    def __getitem__(self,colname):
+        return self.column(colname)
+
+
+class YearPositionIndex:
+    """Row positions of the data for each year, aligned with the sorted (stand, regime) decisions.
+
+    index[year][i] is the row of decision i = decisions[i] in that year, or -1
+    if the data has no row for it. The positions are matched by (stand, regime)
+    and not by sort order, so they stay aligned also if some years have rows
+    for other stands or regimes than the first year.
+    """
+
+    def __init__(self,stands,times,regimes,years,decisions,rows=None):
+        self.decisions = decisions
+        rows = np.arange(len(stands)) if rows is None else np.asarray(rows)
+        decisionNumbers = decisions.get_indexer(pd.MultiIndex.from_arrays([stands,regimes]))
+        times = np.asarray(times)
+        self.positions = dict()
+        for year in years:
+            inYear = (times == year) & (decisionNumbers >= 0)
+            positions = np.full(len(decisions),-1,dtype=np.int64)
+            positions[decisionNumbers[inYear]] = rows[inYear]
+            self.positions[year] = positions
+        self.complete = all((positions >= 0).all() for positions in self.positions.values())
+
+    def __getitem__(self,year):
+        return self.positions[year]
+
+    def take(self,valuesAt,year):
+        """valuesAt(rows) at the rows of year in decision order, zero for decisions without data."""
+        positions = self.positions[year]
+        if self.complete:
+            return valuesAt(positions)
+        found = positions >= 0
+        values = valuesAt(positions[found])
+        result = np.zeros(len(positions),dtype=values.dtype)
+        result[found] = values
+        return result
+
+    def check(self,decisionIndex):
+        """Raise ValueError if decisionIndex is not in the order of the index."""
+        if len(decisionIndex) != len(self.decisions) or not all(
+                np.array_equal(np.asarray(self.decisions.get_level_values(level)),np.asarray(decisionIndex.get_level_values(level)))
+                for level in range(2)):
+            raise ValueError("Decision variables are not in the (stand, regime) order of the year position index")
+
+
+def readDataFile(filename,options):
+    """Read one file of a multi-file readData in a worker process.
+
+    Returns the data frame, or the path of the Arrow file for lazy data.
+    """
+    mfo = MultiFunctionalOptimization.__new__(MultiFunctionalOptimization)
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        mfo.readData(filename,**options)
+    if isinstance(mfo.data,LazyFrame):
+        return mfo.data.path
+    return mfo.data
+
+
+solveStatusNames = {pywraplp.Solver.OPTIMAL:"optimal",pywraplp.Solver.FEASIBLE:"feasible",
+                    pywraplp.Solver.INFEASIBLE:"infeasible",pywraplp.Solver.UNBOUNDED:"unbounded",
+                    pywraplp.Solver.ABNORMAL:"abnormal",pywraplp.Solver.MODEL_INVALID:"model invalid",
+                    pywraplp.Solver.NOT_SOLVED:"not solved"}
+
+workerModel = dict()
+
+def loadWorkerModel(solverConfig,model,warmStart=False):
+    """Load the serialized model into the solver of a worker process."""
+    proto = linear_solver_pb2.MPModelProto()
+    proto.ParseFromString(model)
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        solver = solverConfig.createSolver()
+    error = solver.LoadModelFromProto(proto)
+    if len(error) > 0:
+        raise ValueError("Could not load the model: "+error)
+    constraints = solver.constraints()
+    if len(constraints) < len(proto.constraint):
+        #Free rows are left out when loading, they are added back to keep the row indices of the model
+        loaded = iter(constraints)
+        variables = solver.variables()
+        constraints = []
+        for row in proto.constraint:
+            if row.lower_bound <= -solver.infinity() and row.upper_bound >= solver.infinity():
+                constraint = solver.Constraint(row.lower_bound,row.upper_bound,row.name)
+                for variable,coefficient in zip(row.var_index,row.coefficient):
+                    constraint.SetCoefficient(variables[variable],coefficient)
+            else:
+                constraint = next(loaded)
+            constraints.append(constraint)
+    workerModel.update(solver=solver,solverConfig=solverConfig,constraints=constraints,warmStart=warmStart,solved=False)
+
+def solveWorkerModel(task):
+    """Solve the model of a worker process after the changes given in task.
+
+    task has the objective as {variable index: coefficient}, "maximize", and
+    optionally "bounds" {constraint index: (lb,ub)}, "coefficients"
+    {(constraint index,variable index): coefficient} and the indices of the
+    variables to report in "values". The changes stay in the worker model.
+    """
+    solver = workerModel["solver"]
+    applyModelChanges(solver,task,workerModel["constraints"])
+    result = solveWorker()
+    result["values"] = solutionValues(solver,task.get("values",[]),result["status"])
+    return result
+
+def solveWorker(label=""):
+    """Solve the model of the worker process. Returns the status, iterations, time and warm start use."""
+    solver = workerModel["solver"]
+    now = datetime.now()
+    res,iterations = workerModel["solverConfig"].solve(solver,workerModel["warmStart"])
+    result = {"status":res,"iterations":iterations,
+              "seconds":(datetime.now()-now).total_seconds(),"warmStart":workerModel["warmStart"] and workerModel["solved"]}
+    workerModel["solved"] = True
+    return result
+
+def solutionValues(solver,variables,status):
+    """Solution values of the variables with the given indices, None if there is no solution."""
+    if status not in [solver.OPTIMAL,solver.FEASIBLE]:
+        return None
+    solverVariables = solver.variables()
+    return [solverVariables[variable].solution_value() for variable in variables]
+
+def solveEpsilonChain(chain):
+    """Solve an epsilon constraint chain (see epsilonChain) in a worker process."""
+    return epsilonChain(workerModel["solver"],solveWorker,chain,workerModel["constraints"])
+
+def epsilonChain(solver,solve,chain,constraints=None):
+    """Solve the points of an epsilon grid in the order of tightening bounds, as in AUGMECON2.
+
+    chain is a task (see solveWorkerModel) with the epsilon constraint in "row", its
+    objective variable in "variable", "sense" 1 for a lower and -1 for an upper bound,
+    the bounds in "grid" and their spacing in "step". The next points within the slack
+    of a solution give the same solution and are skipped, and the chain stops at the
+    first infeasible point. solve(label) solves the problem and returns the status,
+    iterations, time and warm start use.
+    """
+    if constraints is None:
+        constraints = solver.constraints()
+    applyModelChanges(solver,chain,constraints)
+    constraint = constraints[chain["row"]]
+    variable = solver.variables()[chain["variable"]]
+    results = []
+    i = 0
+    while i < len(chain["grid"]):
+        epsilon = chain["grid"][i]
+        if chain["sense"] > 0:
+            constraint.SetBounds(epsilon,solver.infinity())
+        else:
+            constraint.SetBounds(-solver.infinity(),epsilon)
+        label = chain["label"]+" point "+str(i)
+        result = solve(label)
+        result.update(label=label,epsilon=epsilon,values=solutionValues(solver,chain["values"],result["status"]))
+        results.append(result)
+        if result["values"] is None:
+            break
+        slack = chain["sense"]*(variable.solution_value()-epsilon)
+        i += 1+(int(max(slack,0)//chain["step"]) if chain["step"] > 0 else 0)
+    return results
+
+def applyModelChanges(solver,task,constraints=None):
+    """Set the coefficients, bounds and objective of task (see solveWorkerModel) in solver.
+    The objective replaces the previous objective. constraints are the rows by model index."""
+    if constraints is None:
+        constraints = solver.constraints()
+    variables = solver.variables()
+    for (constraint,variable),coefficient in task.get("coefficients",dict()).items():
+        constraints[constraint].SetCoefficient(variables[variable],coefficient)
+    for constraint,(lb,ub) in task.get("bounds",dict()).items():
+        constraints[constraint].SetBounds(lb,ub)
+    objective = solver.Objective()
+    objective.Clear()
+    for variable,coefficient in task["objective"].items():
+        objective.SetCoefficient(variables[variable],coefficient)
+    if task["maximize"]:
+        objective.SetMaximization()
+    else:
+        objective.SetMinimization()
+
+def parallelWorkers(workers,tasks,modelSize):
+    """Number of worker processes for tasks on a model of modelSize bytes, capped by the available memory."""
+    if workers is None:
+        workers = os.cpu_count()
+    try:
+        available = os.sysconf("SC_AVPHYS_PAGES")*os.sysconf("SC_PAGE_SIZE")
+        # A worker needs about ten times the serialized model besides the interpreter
+        workers = min(workers,available//(10*modelSize+2**28))
+    except (ValueError,AttributeError,OSError):
+        pass
+    return int(max(1,min(workers,tasks)))
+
+
 class MultiFunctionalOptimization:
 
     data = pd.DataFrame()
@@ -34,82 +506,333 @@ class MultiFunctionalOptimization:
 
     debug = False
 
+    floatDtype = None
+    tensorStore = False
+    # Memory limit of the column tensors, the least recently used ones are freed above it
+    tensorCacheBytes = 2**30
+    reportConditioning = False
+    materializeTotals = True
+    warmStart = False
+    relativeColumns = dict()
+
 
     # Open source solver, if commercial is not available
     def __init__(self,solver="CLP"):
-        if solver == "CLP":
-            self.solver = pywraplp.Solver('MultiForest Optimization Problem',
-                            pywraplp.Solver.CLP_LINEAR_PROGRAMMING)
-            display("Using CLP")
-        elif solver == "CPLEX":
-            self.solver = pywraplp.Solver('MultiForest Optimization Problem',
-                            pywraplp.Solver.CPLEX_LINEAR_PROGRAMMING)
-            display("Using CPLEX")
-        elif solver == "GLOP":
-            self.solver = pywraplp.Solver('MultiForest Optimization Problem',
-                            pywraplp.Solver.GLOP_LINEAR_PROGRAMMING)
-            display("Using GLOP")
+        """solver is a backend name or a SolverConfig with the solver parameters."""
+        if isinstance(solver,SolverConfig):
+            self.solverConfig = solver
+            self.solver = self.solverConfig.createSolver()
         else:
-            display("Undefined solver, using CLP")     
-            self.solver = pywraplp.Solver('MultiForest Optimization Problem',
-                            pywraplp.Solver.CLP_LINEAR_PROGRAMMING)
-        
+            try:
+                self.solverConfig = SolverConfig(solver)
+                self.solver = self.solverConfig.createSolver()
+            except ValueError:
+                display("Solver "+str(solver)+" is not available, using CLP")
+                self.solverConfig = SolverConfig("CLP")
+                self.solver = self.solverConfig.createSolver()
+        display("Using "+self.solverConfig.backend)
+        self.derivedColumns = dict()
+        self.derivedCache = dict()
+        self.tensors = dict()
+        self.regimeClasses = dict()
+        self.regimeClassColumns = dict()
+        self.startSolveSession()
+
+    @staticmethod
+    def requiredColumns(objectives=dict(),constraintTypes=dict(),transferRates=dict(),columnTypes=dict(),extraColumns=()):
+        """Columns of the input data referenced by an objective/constraint/GLOBIOM spec.
+
+        Names are returned together with the names they are derived from
+        ("Relative_Total_X" -> "Total_X", "X"), so the result can be given to
+        readData as columns. Columns that are created in the notebook (e.g.
+        "CCFonPeat") need their own input columns in extraColumns.
+        """
+        names = set(extraColumns)
+        for objective in objectives.values():
+            names.add(objective[1])
+            if objective[4] == "subsetSum":
+                names.add(objective[-1])
+        for constraint in constraintTypes.values():
+            if constraint[0] == "Allowed regimes":
+                names.add(constraint[3])
+            elif constraint[0] == "Species reduction":
+                names.add(constraint[2])
+            elif constraint[0] == "less than":
+                names.update(constraint[2:4])
+        names.update(transferRates.keys())
+        columns = set()
+        for name in names:
+            columns.add(name)
+            if name.startswith("Relative_"):
+                name = name[len("Relative_"):]
+                columns.add(name)
+            if name.startswith("Total_"):
+                columns.add(name[len("Total_"):])
+        if any(columnType[1] == "Relative to Volume" for columnType in columnTypes.values()):
+            columns.add("V")
+        return columns
 
     def readData(self,filename,sampleRatio=1,delimeter=";",
                 standsEnu = "id",regimesEnu = ["regime"],timeEnu = "year",
-                areaCol = "represented_area_by_NFIplot",samplingSubsets = None):
+                areaCol = "represented_area_by_NFIplot",samplingSubsets = None,
+                useCache = True,cacheDir = None,cacheSizeLimit = 20*2**30,
+                columns = None,chunkSize = 10**6,compact = False,floatDtype = "float32",
+                sampleSeed = 18052021,lazy = False,
+                sourceCol = "sourceRegion",sourceName = None,workers = None):
         self.sampleRatio = sampleRatio
         self.areaCol = areaCol
         self.timeEnu = timeEnu
-        try:
-            self.data = pd.read_hdf(filename.split(".")[0]+".h5",key="df")
-        except:
-            self.data = pd.read_csv(filename,delimiter=delimeter)
-            self.data.to_hdf(filename.split(".")[0]+".h5",key="df")
         self.standsEnu = standsEnu
-        if len(regimesEnu) == 1:
-            self.regimesEnu = regimesEnu[0]
+        self.regimesEnu = regimesEnu[0] if len(regimesEnu) == 1 else "combinedRegime"
+        self.floatDtype = floatDtype if compact else None
+        if not isinstance(filename,str) or glob.has_magic(filename):
+            #Several files (e.g. one per region), read in parallel
+            filenames = sorted(glob.glob(filename)) if isinstance(filename,str) else list(filename)
+            options = {"sampleRatio":sampleRatio,"delimeter":delimeter,"standsEnu":standsEnu,"regimesEnu":regimesEnu,
+                       "timeEnu":timeEnu,"areaCol":areaCol,"samplingSubsets":samplingSubsets,"useCache":useCache,
+                       "cacheDir":cacheDir,"cacheSizeLimit":cacheSizeLimit,"columns":columns,"chunkSize":chunkSize,
+                       "compact":compact,"floatDtype":floatDtype,"sampleSeed":sampleSeed,"lazy":lazy,"sourceCol":sourceCol}
+            self.readDataFiles(filenames,options,workers)
+            return
+        #Only keep the given columns and the index, area and sampling columns
+        usecols = None
+        if columns is not None:
+            keepColumns = set(columns) | set(regimesEnu) | {standsEnu,timeEnu,areaCol}
+            if samplingSubsets is not None:
+                keepColumns.add(samplingSubsets)
+            usecols = lambda colname: colname in keepColumns
+        cache = None
+        cached = None
+        if (useCache or lazy) and pa is not None:
+            if cacheDir is None:
+                cacheDir = os.path.join(os.path.dirname(os.path.abspath(filename)),".mfoCache")
+            cache = ColumnarCache(cacheDir,cacheSizeLimit)
+            cacheKey = cache.key(filename,{"delimeter":delimeter,"standsEnu":standsEnu,"regimesEnu":tuple(regimesEnu),
+                                           "sampleRatio":sampleRatio,"samplingSubsets":samplingSubsets,"sampleSeed":sampleSeed,
+                                           "columns":None if usecols is None else tuple(sorted(keepColumns)),
+                                           "compact":floatDtype if compact else False,"lazy":lazy,
+                                           "source":None if sourceName is None else (sourceCol,sourceName)})
+            if useCache and not lazy:
+                cached = cache.load(cacheKey)
+        elif lazy:
+            raise ImportError("Lazy data needs pyarrow")
+        elif useCache:
+            display("pyarrow not available, reading data without cache")
+        if cached is not None:
+            self.data = cached
+            display("Read data from cache "+cache.path(cacheKey))
+        elif lazy and useCache and os.path.isfile(cache.path(cacheKey)):
+            os.utime(cache.path(cacheKey))
+            display("Read data from cache "+cache.path(cacheKey))
         else:
-            self.regimesEnu = "combinedRegime"
-            self.data["combinedRegime"] = [""]*len(self.data)
-            for i,colname in enumerate(regimesEnu):
-                self.data["combinedRegime"]+=[colname]*len(self.data)
-                self.data["combinedRegime"]+=self.data[colname].astype(str).values
-                if i < len(regimesEnu)-1:
-                    self.data["combinedRegime"]+=["_"]*len(self.data)
-        self.data.replace(np.nan,0,inplace=True)
-        if sampleRatio < 1:
-            if samplingSubsets is None:
-                n = int(len(set(self.data[self.standsEnu].values))*sampleRatio)
-                #Setting seed to todays date: 18052021
-                np.random.seed(18052021)
-                stand_sample = np.random.choice(list(set(self.data[self.standsEnu].values)),n,replace=False)
-                display("sample size "+str(n)+"/"+str(len(set(self.data[self.standsEnu].values)))+"("+str(int(n/len(set(self.data[self.standsEnu].values))*100))+"%)")
+            standSample = None
+            if sampleRatio < 1:
+                standSample = self.sampleStands(filename,sampleRatio,delimeter=delimeter,samplingSubsets=samplingSubsets,
+                                                seed=sampleSeed,chunkSize=chunkSize)
+            chunks = (chunk if standSample is None else chunk[chunk[standsEnu].isin(standSample)]
+                      for chunk in pd.read_csv(filename,delimiter=delimeter,usecols=usecols,chunksize=chunkSize))
+            if lazy:
+                #Write the chunks to disk without keeping them in memory
+                labels = dict()
+                cache.storeChunks(cacheKey,(self.prepareLazyChunk(chunk,regimesEnu,sourceCol,sourceName,labels) for chunk in chunks))
             else:
-                stand_sample = np.array([])
-                for val in self.data[samplingSubsets].unique():
-                    n = int(len(set(self.data[self.data[samplingSubsets] == val][self.standsEnu].values))*sampleRatio)
-                    #Setting seed to todays date: 18052021
-                    np.random.seed(18052021)
-                    stand_sample = np.append(stand_sample,np.random.choice(list(set(self.data[self.data[samplingSubsets] == val][self.standsEnu].values)),n,replace=False))
-            self.data = self.data[self.data[self.standsEnu].isin(stand_sample)]
-            
+                self.data = pd.concat(chunks,ignore_index=True)
+                if sourceName is not None:
+                    self.data[sourceCol] = pd.Categorical.from_codes(np.zeros(len(self.data),dtype=np.int8),categories=[sourceName])
+                if len(regimesEnu) > 1:
+                    self.data["combinedRegime"] = self.combineRegimeColumns(self.data,regimesEnu)
+                self.data.replace(np.nan,0,inplace=True)
+                if compact:
+                    self.compactData()
+                if cache is not None:
+                    cache.store(cacheKey,self.data)
+        if lazy:
+            self.data = LazyFrame(cache.path(cacheKey))
+        report = self.memoryReport()
+        display("Data uses "+str(round(report["MB"].sum(),1))+" MB for "+str(len(self.data))+" rows"+(" (on disk)" if lazy else ""))
+        display(report)
+
+    def readDataFiles(self,filenames,options,workers=None):
+        """Read several files in worker processes and concatenate them.
+
+        Each row is tagged in column options["sourceCol"] with the name of its
+        file without extension, e.g. "rslt_RCP0_CentralFinland". Categorical
+        columns get the union of the categories of all files.
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        sourceNames = [self.sourceNameOfFile(filename) for filename in filenames]
+        if len(set(sourceNames)) < len(sourceNames):
+            raise ValueError("Files with the same name would get the same "+options["sourceCol"]+": "+str(filenames))
+        with ProcessPoolExecutor(max_workers=max(1,min(workers,len(filenames)))) as pool:
+            results = list(pool.map(readDataFile,filenames,[dict(options,sourceName=name) for name in sourceNames]))
+        if options["lazy"]:
+            self.data = LazyFrame(results)
+        else:
+            for colname in results[0].columns:
+                if all(isinstance(frame[colname].dtype,pd.CategoricalDtype) for frame in results):
+                    categories = pd.api.types.union_categoricals([frame[colname] for frame in results],sort_categories=True).categories
+                    for frame in results:
+                        frame[colname] = frame[colname].cat.set_categories(categories)
+            self.data = pd.concat(results,ignore_index=True)
+            if self.data.groupby(self.standsEnu,observed=True)[options["sourceCol"]].nunique().max() > 1:
+                display("Warning: the same stand ids are used in several files")
+        report = self.memoryReport()
+        display("Data uses "+str(round(report["MB"].sum(),1))+" MB for "+str(len(self.data))+" rows from "+str(len(filenames))+" files"+(" (on disk)" if options["lazy"] else ""))
+        display(report)
+
+    @staticmethod
+    def sourceNameOfFile(filename):
+        """Name of a data file without the directory and the .csv, .zip or .csv.zip extension."""
+        name = os.path.basename(filename)
+        for extension in [".zip",".csv"]:
+            root,ext = os.path.splitext(name)
+            if ext.lower() == extension:
+                name = root
+        return name
+
+    def prepareLazyChunk(self,chunk,regimesEnu,sourceCol="sourceRegion",sourceName=None,labels=None):
+        """Give a chunk of lazily read data the same column types as all other chunks.
+
+        Label columns become categoricals. labels holds the labels of each column
+        seen in the earlier chunks, new labels are appended so that the codes of
+        the earlier chunks stay valid.
+        """
+        labels = dict() if labels is None else labels
+        if len(regimesEnu) > 1:
+            chunk["combinedRegime"] = np.asarray(self.combineRegimeColumns(chunk,regimesEnu)).astype(str)
+        if sourceName is not None:
+            chunk[sourceCol] = sourceName
+        chunk = chunk.fillna(0)
+        for colname in chunk.columns:
+            if colname in [self.standsEnu,self.timeEnu] and pd.api.types.is_numeric_dtype(chunk.dtypes[colname]):
+                chunk[colname] = chunk[colname].astype(np.int64)
+            elif pd.api.types.is_numeric_dtype(chunk.dtypes[colname]):
+                chunk[colname] = chunk[colname].astype(self.floatDtype or np.float64)
+            else:
+                values = chunk[colname].astype(str)
+                known = labels.setdefault(colname,pd.Index([],dtype=object))
+                labels[colname] = known.append(pd.Index(values.unique()).difference(known,sort=False))
+                chunk[colname] = pd.Categorical(values,categories=labels[colname])
+        return chunk
+
+    def sampleStands(self,filename,sampleRatio,delimeter=";",samplingSubsets=None,seed=18052021,chunkSize=10**6):
+        """Draw a random sample of stand ids, stratified by samplingSubsets if given.
+
+        Only the id and stratum columns are read. sampleRatio of the stands of
+        each stratum are drawn with a local random generator, so the sample
+        only depends on the data and the seed.
+        """
+        keyColumns = [self.standsEnu] if samplingSubsets is None else [self.standsEnu,samplingSubsets]
+        stands = pd.concat([chunk.drop_duplicates() for chunk in
+                            pd.read_csv(filename,delimiter=delimeter,usecols=keyColumns,chunksize=chunkSize)])
+        stands = stands.drop_duplicates().sort_values(keyColumns[::-1],ignore_index=True)
+        strata = stands[samplingSubsets] if samplingSubsets is not None else np.zeros(len(stands))
+        stands["draw"] = np.random.default_rng(seed).random(len(stands))
+        rank = stands.groupby(strata,dropna=False)["draw"].rank(method="first")
+        size = stands.groupby(strata,dropna=False)["draw"].transform("size")
+        standSample = stands.loc[rank <= (size*sampleRatio).astype(int),self.standsEnu].unique()
+        n = len(standSample)
+        N = stands[self.standsEnu].nunique()
+        display("sample size "+str(n)+"/"+str(N)+"("+str(int(n/N*100))+"%)")
+        return standSample
+
+    def combineRegimeColumns(self,data,regimesEnu):
+        """Categorical regime with labels "col1value1_col2value2" built from several columns.
+
+        The column tuples are factorized to integer codes, so a label string
+        is only built once for each distinct combination.
+        """
+        combinedCodes = np.zeros(len(data),dtype=np.int64)
+        labels = [""]
+        for i,colname in enumerate(regimesEnu):
+            codes,uniques = pd.factorize(data[colname],use_na_sentinel=False)
+            combinedCodes,combinations = pd.factorize(combinedCodes*len(uniques)+codes)
+            separator = "_" if i > 0 else ""
+            labels = [labels[combination//len(uniques)]+separator+colname+str(uniques[combination%len(uniques)])
+                      for combination in combinations]
+        # Sorted categories keep the index order the same as with string labels
+        labelCodes,categories = pd.factorize(np.array(labels,dtype=object),sort=True)
+        return pd.Categorical.from_codes(labelCodes[combinedCodes],categories=categories)
+
+    def compactData(self,sparseDensity=None):
+        """Store label columns as categoricals, ids as int32 and floats as self.floatDtype.
+
+        With sparseDensity, numeric and boolean columns where at most that share
+        of the values is nonzero are stored as sparse columns.
+        Can be called again after columns have been added in the notebook.
+        """
+        for colname in self.data.columns:
+            dtype = self.data.dtypes[colname]
+            if isinstance(dtype,pd.SparseDtype):
+                continue
+            if sparseDensity is not None and colname not in [self.standsEnu,self.timeEnu,self.areaCol] and (
+                    pd.api.types.is_float_dtype(dtype) or pd.api.types.is_bool_dtype(dtype)):
+                if np.count_nonzero(self.data[colname].values) <= sparseDensity*len(self.data):
+                    if pd.api.types.is_float_dtype(dtype) and self.floatDtype is not None:
+                        dtype = self.floatDtype
+                    self.data[colname] = self.data[colname].astype(pd.SparseDtype(dtype,False if pd.api.types.is_bool_dtype(dtype) else 0))
+                    continue
+            if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+                self.data[colname] = self.data[colname].astype("category")
+            elif colname == self.standsEnu and pd.api.types.is_integer_dtype(dtype):
+                if self.data[colname].min() >= np.iinfo(np.int32).min and self.data[colname].max() <= np.iinfo(np.int32).max:
+                    self.data[colname] = self.data[colname].astype(np.int32)
+            elif pd.api.types.is_float_dtype(dtype) and self.floatDtype is not None:
+                self.data[colname] = self.data[colname].astype(self.floatDtype)
+
+    def memoryReport(self,deep=False):
+        """Memory usage of self.data per column in megabytes (size on disk for lazy data).
+
+        Without deep text columns are counted without their strings, which would
+        have to be walked one by one.
+        """
+        if isinstance(self.data,LazyFrame):
+            table = self.data.table
+            return pd.DataFrame({"dtype":[str(field.type) for field in table.schema],
+                                 "MB":[table.column(colname).nbytes/2**20 for colname in table.column_names]},index=table.column_names)
+        usage = self.data.memory_usage(index=False,deep=deep)
+        return pd.DataFrame({"dtype":self.data.dtypes.astype(str),"MB":usage/2**20})
 
     def CalculateTotalValues(self,**kwargs):
         self.columnTypes = kwargs
+        if isinstance(self.data,LazyFrame):
+            #Lazy data is already numeric
+            for colname in self.data.columns:
+                if colname in self.columnTypes.keys():
+                    if self.columnTypes[colname][1] == "Relative to Area":
+                        self.addTotalColumn(colname,"represented_area_by_NFIplot")
+                    elif self.columnTypes[colname][1] == "Relative to Volume":
+                        self.addTotalColumn(colname,"V")
+            return
         for colname in self.data.columns:
             try:
-                self.data[colname] = self.data[colname].astype(self.columnTypes[colname][0]).values
+                dtype = self.columnTypes[colname][0]
+                if dtype == float and self.floatDtype is not None:
+                    dtype = self.floatDtype
+                self.data[colname] = self.data[colname].astype(dtype).values
                 if self.columnTypes[colname][1] == "Relative to Area":
-                    self.data["Total_"+colname]=self.data[colname].values*self.data["represented_area_by_NFIplot"].values
+                    self.addTotalColumn(colname,"represented_area_by_NFIplot")
                 elif self.columnTypes[colname][1] == "Relative to Volume":
-                    self.data["Total_"+colname]=self.data[colname].values*self.data["V"].values
+                    self.addTotalColumn(colname,"V")
             except KeyError:
                 if not colname in [self.timeEnu,self.regimesEnu,self.standsEnu]:
                     self.data[colname] = pd.to_numeric(self.data[colname],errors="ignore").values
 
     
-    def calculateTotalValuesFromRelativeValues(self,columnTypes = dict()):
+    def addTotalColumn(self,colname,weightColname):
+        """Total_ column colname*weightColname, stored in self.data if self.materializeTotals is set
+        and the data is in memory, otherwise a derived column."""
+        if self.materializeTotals and not isinstance(self.data,LazyFrame):
+            self.derivedColumns.pop("Total_"+colname,None)
+            self.evictColumns(["Total_"+colname])
+            self.data["Total_"+colname] = self.data[colname].values*self.data[weightColname].values
+        else:
+            self.defineColumn("Total_"+colname,self.productColumn(colname,weightColname))
+
+    def calculateTotalValuesFromRelativeValues(self,columnTypes = dict(),materialize = True):
+        """With materialize the Total_ columns are stored in self.data, otherwise they are derived columns."""
+        self.materializeTotals = materialize
         if len(columnTypes) > 0: #If data about column types is given use that
             self.CalculateTotalValues(**columnTypes)
         else: ##If no data is given show a gui for selecting data
@@ -119,24 +842,139 @@ class MultiFunctionalOptimization:
             </style>'''))
             display(colTypeChooser)
 
-    def addRegimes(self,**kwargs):
-        for i in range(10):
-            try:
-                if len(kwargs["regimeClass"+str(i)+"name"])>0:
-                    self.data[kwargs["regimeClass"+str(i)+"name"]+"_forests"] = self.data[self.regimesEnu].isin(kwargs["regimeClass"+str(i)+"regimes"])
-            except KeyError:
-                pass
-    def addRegimeClassifications(self,regimeClassNames = dict(),regimeClassregimes=dict()):
+    @staticmethod
+    def productColumn(colname1,colname2):
+        """Derived column expression colname1*colname2."""
+        return lambda columns: columns[colname1]*columns[colname2]
+
+    def defineColumn(self,colname,expression):
+        """Declare a derived column that is calculated only when the model uses it.
+
+        expression is a string over column names, e.g. "CCF_forests * PEAT",
+        or a function of a column mapping, e.g. lambda c: c["V"]*c["PEAT"].
+        Derived columns can be used like data columns in objectives and
+        constraints, also as "Relative_" columns after finalizeData.
+        """
+        self.derivedColumns[colname] = expression
+        self.evictColumns([colname])
+        if isinstance(self.data,LazyFrame):
+            self.data[colname] = lambda data,rows: self.evaluateColumn(expression,lambda name: data.column(name,rows))
+
+    def evictColumns(self,colnames=None):
+        """Free the cached values of derived columns, of all of them and all column tensors if colnames is None."""
+        if colnames is None:
+            colnames = list(self.derivedColumns.keys())+list(self.regimeClassColumns.keys())
+            self.tensors.clear()
+        for colname in colnames:
+            self.derivedCache.pop(colname,None)
+            self.tensors.pop(colname,None)
+
+    @staticmethod
+    def evaluateColumn(expression,column):
+        """Values of a derived column expression, column(name) gives the values of a column."""
+        if callable(expression):
+            return np.asarray(expression(ColumnLookup(column)))
+        names = compile(expression,"<expression>","eval").co_names
+        return np.asarray(pd.eval(expression,local_dict={name:column(name) for name in names}))
+
+    def columnValues(self,colname,initial=False,cache=True):
+        """Values of a stored, derived or "Relative_" column in the row order of the data.
+
+        With initial=True the values are for the initial data. Derived
+        columns are evaluated once and kept in self.derivedCache.
+        """
+        data = self.initialData if initial else self.data
+        if colname in data.columns:
+            return data[colname].values
+        if colname in data.index.names:
+            return data.index.get_level_values(colname).values
+        if colname in self.regimeClassColumns:
+            if self.regimesEnu in data.index.names:
+                level = data.index.names.index(self.regimesEnu)
+                return self.regimeClassValues(colname,(data.index.codes[level],data.index.levels[level]))
+            return self.regimeClassValues(colname,data[self.regimesEnu].values)
+        if colname in self.derivedColumns:
+            if initial:
+                return self.evaluateColumn(self.derivedColumns[colname],lambda name: self.columnValues(name,initial=True))
+            if colname in self.derivedCache:
+                return self.derivedCache[colname]
+            values = self.evaluateColumn(self.derivedColumns[colname],self.columnValues)
+            if cache:
+                self.derivedCache[colname] = values
+            return values
+        if colname in self.relativeColumns:
+            basename = self.relativeColumns[colname]
+            if not self.initialTotal(basename) > 0:
+                raise KeyError(colname)
+            return self.columnValues(basename,initial,cache)/self.initialTotal(basename)
+        raise KeyError(colname)
+
+    def addRegimes(self,materialize=True,**kwargs):
+        for key in kwargs.keys():
+            if key.startswith("regimeClass") and key.endswith("name") and len(kwargs[key])>0:
+                regimesKey = key[:-len("name")]+"regimes"
+                if regimesKey in kwargs:
+                    self.regimeClasses[kwargs[key]] = list(kwargs[regimesKey])
+                    colname = kwargs[key]+"_forests"
+                    self.regimeClassColumns[colname] = kwargs[key]
+                    #Derived columns may combine the class column, so their cached values are freed as well
+                    self.evictColumns(list(self.derivedColumns.keys())+[colname])
+                    if isinstance(self.data,LazyFrame):
+                        self.data[colname] = lambda data,rows,colname=colname: self.regimeClassValues(colname,data.codes(self.regimesEnu,rows))
+                        continue
+                    #A column stored by an earlier classification would shadow the new class
+                    for data in [self.data,self.initialData]:
+                        if colname in data.columns:
+                            data.drop(columns=colname,inplace=True)
+                    if materialize:
+                        self.data[colname] = self.columnValues(colname)
+
+    def addRegimeClassifications(self,regimeClassNames = dict(),regimeClassregimes=dict(),numberOfClasses=10,materialize=True):
         if len(regimeClassNames) > 0:
-            self.addRegimes(**regimeClassNames,**regimeClassregimes)
+            self.addRegimes(materialize,**regimeClassNames,**regimeClassregimes)
         else:
-            regimeClassificationChooser = widgets.interactive(self.addRegimes,{"manual":True},
-            **{"regimeClass"+str(i)+"name":widgets.Text() for i in range(10)},
-            **{"regimeClass"+str(i)+"regimes":widgets.SelectMultiple(options=tuple(self.data["regimesEnu"].unique())) for i in range(10)})
+            regimeClassificationChooser = widgets.interactive(self.addRegimes,{"manual":True},materialize=widgets.fixed(materialize),
+            **{"regimeClass"+str(i)+"name":widgets.Text() for i in range(numberOfClasses)},
+            **{"regimeClass"+str(i)+"regimes":widgets.SelectMultiple(options=tuple(pd.unique(self.data[self.regimesEnu]))) for i in range(numberOfClasses)})
             display(regimeClassificationChooser)
 
+    def regimeClassBits(self,regimeNames):
+        """Regime classes of regimeNames as a bitset, one row of bytes per regime.
+
+        Bit k of a row tells if the regime belongs to the k:th class of
+        self.regimeClasses. The last row is for missing regimes (code -1).
+        """
+        classTable = np.zeros((len(regimeNames)+1,len(self.regimeClasses)),dtype=bool)
+        for k,regimes in enumerate(self.regimeClasses.values()):
+            classTable[:-1,k] = np.isin(np.asarray(regimeNames),regimes)
+        return np.packbits(classTable,axis=1)
+
+    def regimeClassValues(self,colname,regimes):
+        """Membership of the rows in the regime class of colname, from the regime codes.
+
+        regimes are the regime values of the rows, a Categorical or an
+        array, or a tuple of codes and regime names.
+        """
+        if isinstance(regimes,tuple):
+            codes,regimeNames = regimes
+        elif isinstance(regimes,pd.Categorical):
+            codes,regimeNames = regimes.codes,regimes.categories
+        else:
+            codes,regimeNames = pd.factorize(regimes)
+        k = list(self.regimeClasses.keys()).index(self.regimeClassColumns[colname])
+        bits = self.regimeClassBits(regimeNames)[:,k >> 3]
+        return ((bits[codes] >> (7-(k & 7))) & 1).astype(bool)
+
     def finalizeData(self,
-                initialRegime = "",initialTime = -np.inf):
+                initialRegime = "",initialTime = -np.inf,tensorStore = True,materializeRelative = True):
+        self.initialTotals = dict()
+        self.relativeColumns = dict()
+        self.tensorStore = tensorStore
+        self.tensors = dict()
+        self.derivedCache = dict()
+        if isinstance(self.data,LazyFrame):
+            self.finalizeLazyData(initialRegime,initialTime)
+            return
         initialRequirement = np.array([True]*len(self.data))
         if len(initialRegime) > 0:
             initialRequirement = initialRequirement*np.array(self.data[self.regimesEnu] == initialRegime)
@@ -151,17 +989,27 @@ class MultiFunctionalOptimization:
             self.initialYear = min(self.initialData.index.get_level_values(self.timeEnu))
         self.data.set_index([self.standsEnu,self.timeEnu,self.regimesEnu],inplace=True)
         self.data.sort_index(inplace=True)
-        #Use initialdata to define relative values if possible
+        #Use initialdata to define relative values if possible. Relative_ columns are stored in the data
+        #with materializeRelative, otherwise they are virtual and calculated in yearValues when used
         if len(initialRegime)>0 or initialTime>-np.inf: 
-            for colname in self.data.columns:
-                try:
-                    if self.initialData.dtypes[colname] == float  and self.initialData[colname].sum()>0:
-                        self.data["Relative_"+colname] = self.data[colname]/self.initialData[colname].sum()
-                except (NameError,KeyError) as _:
-                    pass
+            floatColumns = [colname for colname in self.data.columns
+                            if colname in self.initialData.columns and pd.api.types.is_float_dtype(self.initialData.dtypes[colname])]
+            self.initialTotals = self.initialData[floatColumns].sum().astype(float).to_dict()
+            self.relativeColumns = {"Relative_"+colname:colname for colname in floatColumns if self.initialTotals[colname] > 0}
+            if materializeRelative:
+                for relativeName,colname in self.relativeColumns.items():
+                    self.data[relativeName] = self.data[colname]/self.initialTotals[colname]
+            #Initial totals of derived columns are checked when they are used
+            self.relativeColumns.update({"Relative_"+colname:colname for colname in self.derivedColumns.keys()})
         self.regimes = self.data.index.get_level_values(self.regimesEnu).unique()
         self.years = self.data.index.get_level_values(self.timeEnu).unique()
         self.standIds = self.data.index.get_level_values(self.standsEnu).unique()
+        self.standRegimes = self.data.index[self.data.index.get_level_values(self.timeEnu) == self.years[0]].droplevel(self.timeEnu)
+        self.yearPositions = YearPositionIndex(self.data.index.get_level_values(self.standsEnu),self.data.index.get_level_values(self.timeEnu),
+                                               self.data.index.get_level_values(self.regimesEnu),self.years,self.standRegimes)
+        self.buildAvailableRegimes()
+        if self.tensorStore:
+            self.buildTensorIndex()
 
         self.standAreas = self.data.loc[(slice(None),self.years[0],slice(None)),self.areaCol]
         self.standAreas = self.standAreas.reset_index()
@@ -169,6 +1017,249 @@ class MultiFunctionalOptimization:
         self.standAreas.drop_duplicates(inplace=True)
         self.standAreas.set_index(self.standsEnu,inplace=True)
         self.standAreas.sort_index(inplace=True)
+        # Solver bounds need Python floats, also with compact float32 data
+        self.standAreas = self.standAreas.astype(float)
+
+    def finalizeLazyData(self,initialRegime,initialTime):
+        """finalizeData for lazy data: only the index columns are read.
+
+        Instead of sorting the data, the row positions of each year in the
+        order of (stand, regime) are stored in self.yearPositions.
+        """
+        stands = self.data.column(self.standsEnu)
+        times = self.data.column(self.timeEnu)
+        regimeCodes,regimeNames = self.data.codes(self.regimesEnu)
+        # Renumber the codes in the sorted order of the regime names
+        order = regimeNames.argsort()
+        sortedCodes = np.empty(len(order),dtype=np.int64)
+        sortedCodes[order] = np.arange(len(order))
+        regimeCodes,regimeNames = sortedCodes[regimeCodes],regimeNames[order]
+        initialRequirement = np.zeros(len(self.data),dtype=bool)
+        if len(initialRegime)>0 or initialTime>-np.inf:
+            initialRequirement[:] = True
+            if len(initialRegime) > 0:
+                initialRequirement &= regimeCodes == regimeNames.get_indexer([initialRegime])[0]
+            if initialTime > -np.inf:
+                initialRequirement &= times == initialTime
+            self.initialRows = np.flatnonzero(initialRequirement)
+            self.initialYear = times[self.initialRows].min()
+        rows = np.flatnonzero(~initialRequirement)
+        rows = rows[np.lexsort((regimeCodes[rows],times[rows],stands[rows]))]
+        self.regimes = regimeNames[pd.unique(regimeCodes[rows])]
+        self.years = pd.Index(np.unique(times[rows]))
+        self.standIds = pd.Index(np.unique(stands[rows]))
+        firstRows = rows[times[rows] == self.years[0]]
+        standCodes,standLevel = pd.factorize(stands[firstRows],sort=True)
+        self.standRegimes = pd.MultiIndex(levels=[standLevel,regimeNames],codes=[standCodes,regimeCodes[firstRows]],
+                                          names=[self.standsEnu,self.regimesEnu]).remove_unused_levels()
+        self.yearPositions = YearPositionIndex(stands[rows],times[rows],pd.Categorical.from_codes(regimeCodes[rows],regimeNames),
+                                               self.years,self.standRegimes,rows=rows)
+        self.buildAvailableRegimes()
+        #Relative values of float and derived columns are derived when needed, if the initial total is positive
+        if len(initialRegime)>0 or initialTime>-np.inf:
+            for colname in self.data.columns:
+                if colname not in [self.standsEnu,self.timeEnu,self.regimesEnu] and self.data.isFloat(colname):
+                    self.data["Relative_"+colname] = self.relativeColumn(colname)
+
+        self.standAreas = pd.DataFrame({self.areaCol:self.data.column(self.areaCol,firstRows)},
+                                       index=pd.Index(stands[firstRows],name=self.standsEnu))
+        self.standAreas = self.standAreas[~self.standAreas.index.duplicated()].astype(float)
+
+    def relativeColumn(self,colname):
+        """Derived column colname relative to its initial total for lazy data."""
+        def values(data,rows):
+            if not self.initialTotal(colname) > 0:
+                raise KeyError("Relative_"+colname)
+            return data.column(colname,rows)/self.initialTotal(colname)
+        return values
+
+    def initialTotal(self,colname):
+        """Sum of colname over the initial data."""
+        if colname not in self.initialTotals:
+            if isinstance(self.data,LazyFrame):
+                self.initialTotals[colname] = float(self.data.column(colname,self.initialRows).sum())
+            else:
+                self.initialTotals[colname] = float(self.columnValues(colname,initial=True).sum())
+        return self.initialTotals[colname]
+
+    def buildAvailableRegimes(self):
+        """Available regimes of each stand in CSR form.
+
+        The regimes of self.standIds[i] are
+        self.regimes[self.availableRegimeIndices[self.availableRegimePointers[i]:self.availableRegimePointers[i+1]]],
+        in the order of self.regimes.
+        """
+        standPositions = self.standIds.get_indexer(self.standRegimes.get_level_values(self.standsEnu))
+        regimePositions = self.regimes.get_indexer(self.standRegimes.get_level_values(self.regimesEnu))
+        order = np.lexsort((regimePositions,standPositions))
+        self.availableRegimeIndices = regimePositions[order]
+        self.availableRegimePointers = np.zeros(len(self.standIds)+1,dtype=np.int64)
+        np.cumsum(np.bincount(standPositions,minlength=len(self.standIds)),out=self.availableRegimePointers[1:])
+
+    def buildTensorIndex(self):
+        """Positions of the data rows in the stand x year x regime tensors.
+
+        self.regimeAxis has the regimes in sorted order, so the valid entries
+        of a year in self.validity are in the order of the sorted (stand, regime)
+        decisions. self.decisionPositions are their flat positions in a year.
+        """
+        self.regimeAxis = pd.Index(sorted(self.regimes))
+        self.rowStands = self.standIds.get_indexer(self.data.index.get_level_values(self.standsEnu)).astype(np.int32)
+        self.rowYears = self.years.get_indexer(self.data.index.get_level_values(self.timeEnu)).astype(np.int32)
+        self.rowRegimes = self.regimeAxis.get_indexer(self.data.index.get_level_values(self.regimesEnu)).astype(np.int32)
+        self.validity = np.zeros((len(self.standIds),len(self.regimeAxis)),dtype=bool)
+        firstYear = self.rowYears == 0
+        self.validity[self.rowStands[firstYear],self.rowRegimes[firstYear]] = True
+        self.decisionPositions = np.flatnonzero(self.validity)
+
+    def tensor(self,colname):
+        """Values of colname as a stand x year x regime array, zero where a stand has no such regime.
+
+        The tensor is built when a column is first used and kept in self.tensors,
+        stored year by year so that the values of one year are contiguous.
+        Clear self.tensors if columns are changed after that.
+        """
+        return self.yearTensor(colname).transpose(1,0,2)
+
+    def yearTensor(self,colname):
+        """Tensor of colname in the year x stand x regime order it is stored in.
+
+        Above self.tensorCacheBytes the least recently used tensors are freed.
+        """
+        if colname in self.tensors:
+            self.tensors[colname] = self.tensors.pop(colname)
+        else:
+            values = self.columnValues(colname,cache=False)
+            tensor = np.zeros((len(self.years),len(self.standIds),len(self.regimeAxis)),dtype=values.dtype)
+            tensor[self.rowYears,self.rowStands,self.rowRegimes] = values
+            self.tensors[colname] = tensor
+            while len(self.tensors) > 1 and sum(tensor.nbytes for tensor in self.tensors.values()) > self.tensorCacheBytes:
+                self.tensors.pop(next(iter(self.tensors)))
+        return self.tensors[colname]
+
+    def yearValues(self,colname,year):
+        """Values of colname in year, in the order of the sorted (stand, regime) decisions."""
+        if colname in self.relativeColumns and colname not in self.data.columns:
+            basename = self.relativeColumns[colname]
+            if not self.initialTotal(basename) > 0:
+                raise KeyError(colname)
+            return self.yearValues(basename,year)/self.initialTotal(basename)
+        if isinstance(self.data,LazyFrame):
+            return self.yearPositions.take(lambda rows: self.data.column(colname,rows),year)
+        if self.tensorStore and not self.isSparse(colname):
+            return self.yearTensor(colname)[self.years.get_loc(year)].ravel()[self.decisionPositions]
+        values = self.columnValues(colname)
+        return self.yearPositions.take(lambda rows: np.asarray(values.take(rows)),year)
+
+    def isSparse(self,colname):
+        """True if colname is stored as a sparse column."""
+        return (not isinstance(self.data,LazyFrame) and colname in self.data.columns
+                and isinstance(self.data.dtypes[colname],pd.SparseDtype))
+
+    def yearMatrix(self,colname):
+        """Values of colname as a year x decision array, in the order of self.years and the decisions."""
+        if colname in self.relativeColumns and colname not in self.data.columns:
+            basename = self.relativeColumns[colname]
+            if not self.initialTotal(basename) > 0:
+                raise KeyError(colname)
+            return self.yearMatrix(basename)/self.initialTotal(basename)
+        if self.tensorStore and self.isSparse(colname):
+            #Only the nonzero rows are placed, sparse columns are not kept in the tensor store
+            values = self.data[colname].values
+            rows = values.sp_index.indices
+            positions = self.rowStands[rows].astype(np.int64)*len(self.regimeAxis)+self.rowRegimes[rows]
+            decisions = np.minimum(np.searchsorted(self.decisionPositions,positions),len(self.decisionPositions)-1)
+            valid = self.decisionPositions[decisions] == positions
+            matrix = np.zeros((len(self.years),len(self.decisionPositions)),dtype=values.dtype.subtype)
+            matrix[self.rowYears[rows[valid]],decisions[valid]] = values.sp_values[valid]
+            return matrix
+        if self.tensorStore and not isinstance(self.data,LazyFrame):
+            return self.yearTensor(colname).reshape(len(self.years),-1)[:,self.decisionPositions]
+        return np.stack([self.yearValues(colname,year) for year in self.years])
+
+    def standWiseCoefficients(self,colname,aggregation="sum",subsetColname=None,relative=None):
+        """Coefficients of the decisions in the stand wise aggregation of colname, one row per year.
+
+        Values are divided by the sample ratio, unless colname is relative
+        to the initial values, and area weighted averages by the total area.
+        """
+        if relative is None:
+            relative = "Relative_" in colname
+        values = self.yearMatrix(colname)
+        if aggregation in ["areaWeightedAverage","areaWeightedSum"]:
+            values = values*self.yearMatrix(self.areaCol)
+        elif aggregation == "subsetSum":
+            values = values*self.yearMatrix(subsetColname)
+        values = np.asarray(values,dtype=float)
+        if aggregation == "areaWeightedAverage":
+            return values*(1.0/self.standAreas.values.sum())
+        if relative:
+            return values
+        return values*(1.0/self.sampleRatio)
+
+    @staticmethod
+    def aggregateKey(colname,aggregation="sum",subsetColname=None,relative=None):
+        """Key of a stand wise aggregate in self.aggregates."""
+        if relative is None:
+            relative = "Relative_" in colname
+        if aggregation != "subsetSum":
+            subsetColname = None
+        return (colname,aggregation,subsetColname,relative)
+
+    def yearWiseWeights(self,aggregation):
+        """Weights of the years in the sum, average, firstYear and lastYear year wise aggregations."""
+        weights = np.zeros(len(self.years))
+        if aggregation == "sum":
+            weights[:] = 1
+        elif aggregation == "average":
+            weights[:] = 1/len(self.years)
+        elif aggregation == "firstYear":
+            weights[0] = 1
+        elif aggregation == "lastYear":
+            weights[-1] = 1
+        return weights
+
+    def aggregateVariables(self,colname,aggregation="sum",subsetColname=None,relative=None):
+        """Variables by year equal to the stand wise aggregation of colname.
+
+        Each distinct (column, aggregation, subset column, relative) aggregate
+        is built once and kept in self.aggregates, so objectives, constraints
+        and GLOBIOM sources that use the same aggregate share its variables and rows.
+        """
+        key = self.aggregateKey(colname,aggregation,subsetColname,relative)
+        colname,aggregation,subsetColname,relative = key
+        if key not in self.aggregates:
+            name = colname+aggregation+("" if subsetColname is None else subsetColname)+("Relative" if relative else "")
+            variables = [self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),name+"InYear"+str(year)) for year in self.years]
+            self.addAggregationRows(variables,self.standWiseCoefficients(colname,aggregation,subsetColname,relative),
+                                    ["constraintfor"+name+"InYear"+str(year) for year in self.years])
+            self.aggregates[key] = dict(zip(self.years,variables))
+        return self.aggregates[key]
+
+    def addAggregationRows(self,variables,coefficients,names):
+        """Add rows sum(variables[i]) == coefficients[i] @ decisions for each row of the coefficient matrix.
+
+        variables[i] is a variable or a list of variables. The coefficients are
+        loaded row by row with SetCoefficient, without building linear
+        expressions of the decision variables. Zero coefficients are skipped,
+        so the rows only have the decisions with nonzero values. As the right
+        hand side is zero, each row is scaled by the geometric mean of its
+        smallest and largest absolute coefficient. The variables are not
+        scaled, column scaling is left to the solver.
+        """
+        decisions = self.decisionFrame["Decision"].values
+        rows = []
+        for rowVariables,rowCoefficients,name in zip(variables,-np.asarray(coefficients,dtype=float),names):
+            row = self.solver.Constraint(0,0,name)
+            nonzero = np.flatnonzero(rowCoefficients)
+            magnitudes = np.abs(rowCoefficients[nonzero])
+            scale = 1/np.sqrt(min(1,magnitudes.min())*max(1,magnitudes.max())) if len(nonzero) > 0 else 1
+            for variable in (rowVariables if isinstance(rowVariables,list) else [rowVariables]):
+                row.SetCoefficient(variable,scale)
+            for decision,coefficient in zip(decisions[nonzero].tolist(),(scale*rowCoefficients[nonzero]).tolist()):
+                row.SetCoefficient(decision,coefficient)
+            rows.append(row)
+        return rows
 
 
     def addConstraints(self,constraintTypes):
@@ -176,25 +1267,22 @@ class MultiFunctionalOptimization:
         self.speciesValues = dict()
         for constraintName in self.constraintTypes.keys():
             if self.constraintTypes[constraintName][0] == "Allowed regimes":
-                self.constraints[constraintName] = dict()
-                for regime in self.regimes:
-                    if regime not in self.constraintTypes[constraintName][2]:
-                        for standId in self.standIds:
-                            if (standId,regime) in self.regimesDecision.keys() and self.data.loc[(standId,self.years[0],regime),self.constraintTypes[constraintName][3]] == 1:
-                                self.constraints[constraintName][(standId,regime)] = self.solver.Add(self.regimesDecision[(standId,regime)]<=1,name = "No"+regime+"with"+self.constraintTypes[constraintName][3]+"onStand"+str(standId))
+                #The decisions of regimes that are not allowed are kept, and the constraint
+                #sets their upper bounds in enableAndDisableConstraints
+                constraintColumn = self.yearValues(self.constraintTypes[constraintName][3],self.years[0])
+                disallowed = (constraintColumn == 1) & ~np.isin(np.asarray(self.standRegimes.get_level_values(self.regimesEnu)),
+                                                                 self.constraintTypes[constraintName][2])
+                self.constraints[constraintName] = dict(zip(self.standRegimes[disallowed],self.decisionFrame["Decision"].values[disallowed]))
             if self.constraintTypes[constraintName][0] == "Species reduction":
                 speciesCol = self.constraintTypes[constraintName][2]
                 periodNo = self.constraintTypes[constraintName][3]
                 reductionAmount = self.constraintTypes[constraintName][4]
                 self.constraints[constraintName] = dict()
+                aggregate = self.aggregateVariables(speciesCol,relative=False)
                 for i,year in enumerate(self.years):
-                    self.speciesValues[(speciesCol,year)] = self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),speciesCol+"amountInyear"+str(year))
-                    self.solver.Add(self.speciesValues[(speciesCol,year)] ==
-                        sum(self.decisionFrame["Decision"].values*
-                                        self.data.loc[(slice(None),year,slice(None)),speciesCol].values)/self.sampleRatio,
-                        name="constraintforSpecies"+speciesCol+"InYear"+str(year))
+                    self.speciesValues[(speciesCol,year)] = aggregate[year]
                     if i>= periodNo:
-                        self.constraints[constraintName][year] = self.solver.Add(self.speciesValues[(speciesCol,year)]-(1-reductionAmount)*self.speciesValues[(speciesCol,year-periodNo)]>=-1e10)
+                        self.constraints[constraintName][year] = self.solver.Add(self.speciesValues[(speciesCol,year)]-(1-reductionAmount)*self.speciesValues[(speciesCol,year-periodNo)]>=-self.solver.infinity())
             if self.constraintTypes[constraintName][0] == "less than":
                 colname1 = self.constraintTypes[constraintName][2]
                 colname2 = self.constraintTypes[constraintName][3]
@@ -202,68 +1290,17 @@ class MultiFunctionalOptimization:
                 standWiseAggregation2 = self.constraintTypes[constraintName][5]
                 self.constraints[constraintName] = dict()
                 self.comparedValues = dict()
-                for regime in self.regimes:
+                #Each compared aggregate is built once, shared with objectives using the same aggregate
+                for colname,standWiseAggregation in [(colname1,standWiseAggregation1),(colname2,standWiseAggregation2)]:
+                    if standWiseAggregation in ["sum","areaWeightedAverage","areaWeightedSum"]:
+                        aggregate = self.aggregateVariables(colname,standWiseAggregation)
+                    else:
+                        aggregate = {year:self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),colname+"amountInyear"+str(year)) for year in self.years}
                     for year in self.years:
-                        self.comparedValues[(colname1,year)] = self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),colname1+"amountInyear"+str(year))
-                        self.comparedValues[(colname2,year)] = self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),colname2+"amountInyear"+str(year))
-                        if standWiseAggregation1 == "sum":
-                            # import pdb; pdb.set_trace()
-                            if not "Relative_" in colname1:
-                                self.solver.Add(self.comparedValues[(colname1,year)] ==
-                                        sum(self.decisionFrame["Decision"].values*
-                                                        self.data.loc[(slice(None),year,slice(None)),colname1].sort_index().values)/self.sampleRatio,
-                                        name="constraintfor"+colname1+"comparisonInYear"+str(year))
-                            else:
-                                    self.solver.Add(self.comparedValues[(colname1,year)] ==
-                                        sum(self.decisionFrame["Decision"].values*
-                                                        self.data.loc[(slice(None),year,slice(None)),colname1].sort_index().values),
-                                        name="constraintfor"+colname1+"comparisonInYear"+str(year))
-                        elif standWiseAggregation1 == "areaWeightedAverage":
-                            self.solver.Add(self.comparedValues[(colname1,year)]==
-                                    sum(self.decisionFrame["Decision"].values*
-                                                    (self.data.loc[(slice(None),year,slice(None)),colname1].sort_index().values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].sort_index().values))/self.standAreas.values.sum(),
-                                    name="constraintfor"+colname1+"comparisonInYear"+str(year))
-                        elif standWiseAggregation1 == "areaWeightedSum":
-                            if not "Relative_" in colname1:
-                                self.solver.Add(self.comparedValues[(colname1,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                (self.data.loc[(slice(None),year,slice(None)),colname1].sort_index().values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].sort_index().values))/self.sampleRatio,
-                                name="constraintfor"+colname1+"comparisonInYear"+str(year))
-                            else:
-                                self.solver.Add(self.comparedValues[(colname1,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                (self.data.loc[(slice(None),year,slice(None)),colname1].sort_index().values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].sort_index().values)),
-                                name="constraintfor"+colname1+"comparisonInYear"+str(year))
-                        if standWiseAggregation2 == "sum":
-                            # import pdb; pdb.set_trace()
-                            if not "Relative_" in colname2:
-                                self.solver.Add(self.comparedValues[(colname2,year)] ==
-                                        sum(self.decisionFrame["Decision"].values*
-                                                        self.data.loc[(slice(None),year,slice(None)),colname2].sort_index().values)/self.sampleRatio,
-                                        name="constraintfor"+colname2+"comparisonInYear"+str(year))
-                            else:
-                                    self.solver.Add(self.comparedValues[(colname2,year)] ==
-                                        sum(self.decisionFrame["Decision"].values*
-                                                        self.data.loc[(slice(None),year,slice(None)),colname2].sort_index().values),
-                                        name="constraintfor"+colname2+"comparisonInYear"+str(year))
-                        elif standWiseAggregation2 == "areaWeightedAverage":
-                            self.solver.Add(self.comparedValues[(colname2,year)]==
-                                    sum(self.decisionFrame["Decision"].values*
-                                                    (self.data.loc[(slice(None),year,slice(None)),colname2].sort_index().values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].sort_index().values))/self.standAreas.values.sum(),
-                                    name="constraintfor"+colname2+"comparisonInYear"+str(year))
-                        elif standWiseAggregation2 == "areaWeightedSum":
-                            if not "Relative_" in colname2:
-                                self.solver.Add(self.comparedValues[(colname2,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                (self.data.loc[(slice(None),year,slice(None)),colname2].sort_index().values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].sort_index().values))/self.sampleRatio,
-                                name="constraintfor"+colname2+"comparisonInYear"+str(year))
-                            else:
-                                self.solver.Add(self.comparedValues[(colname2,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                (self.data.loc[(slice(None),year,slice(None)),colname2].sort_index().values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].sort_index().values)),
-                                name="constraintfor"+colname2+"comparisonInYear"+str(year))
-                        self.constraints[constraintName][year] = self.solver.Add(self.comparedValues[(colname1,year)]-self.comparedValues[(colname2,year)]<=10e10
-                            ,name = colname1 + "lessThan"+colname2+"inYear"+str(year))
+                        self.comparedValues[(colname,year)] = aggregate[year]
+                for year in self.years:
+                    self.constraints[constraintName][year] = self.solver.Add(self.comparedValues[(colname1,year)]-self.comparedValues[(colname2,year)]<=self.solver.infinity()
+                        ,name = colname1 + "lessThan"+colname2+"inYear"+str(year))
 
 
     def defineConstraints(self,constraintTypes):
@@ -281,11 +1318,9 @@ class MultiFunctionalOptimization:
         self.decisionFrame = pd.DataFrame(pd.Series(self.regimesDecision))
         self.decisionFrame.columns = ["Decision"]
         self.decisionFrame.sort_index(inplace=True)
+        self.yearPositions.check(self.decisionFrame.index)
 
         self.objectivesByYear = dict()
-        for objName in self.objectiveTypes.keys():
-            for year in self.years:
-                self.objectivesByYear[(objName,year)] = self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),objName+"year"+str(year))
 
         self.maxDummyConstraints = {objName:
                         self.solver.Constraint(-self.solver.infinity(),self.solver.infinity(),"maxDummyConstraintfor"+objName)
@@ -294,60 +1329,17 @@ class MultiFunctionalOptimization:
         self.initialValues = dict()
 
         display("Aggregating stand wise")
-        # Stand wise aggregation
+        # Stand wise aggregation. Objectives that are fixed combinations of the years are
+        # folded into one row in the year wise aggregation and get no variables by year
+        foldedObjectives = [objName for objName in self.objectiveTypes.keys()
+                            if self.objectiveTypes[objName][3] in ["sum","average","firstYear","lastYear"]
+                            and self.objectiveTypes[objName][4] in ["sum","areaWeightedAverage","areaWeightedSum","subsetSum"]]
         for objName in tqdm(self.objectiveTypes.keys()):
-            if self.objectiveTypes[objName][4] == "sum":
-                for year in self.years:
-                    if not "Relative_" in self.objectiveTypes[objName][1]:
-                        self.solver.Add(self.objectivesByYear[(objName,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][1]].values)/self.sampleRatio,
-                                name="constraintfor"+objName+"InYear"+str(year))
-                    else:
-                            self.solver.Add(self.objectivesByYear[(objName,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][1]].values),
-                                name="constraintfor"+objName+"InYear"+str(year))
-                try:
-                    if "Relative_" in self.objectiveTypes[objName][1]:
-                        self.initialValues[objName] = 1
-                    else:
-                        try:
-                            self.initialValues[objName] = initialValues[objName]
-                        except KeyError:
-                            self.initialValues[objName] = self.initialData.loc[(slice(None),slice(None),slice(None)),self.objectiveTypes[objName][1]].values.sum()
-                except NameError:
-                    pass
-            elif self.objectiveTypes[objName][4] == "areaWeightedAverage":
-                for year in self.years:
-                    self.solver.Add(self.objectivesByYear[(objName,year)]==
-                            sum(self.decisionFrame["Decision"].values*
-                                            (self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][1]].values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].values))/self.standAreas.values.sum(),
-                            name="constraintfor"+objName+"InYear"+str(year))
-                try:
-
-                    if "Relative_" in self.objectiveTypes[objName][1]:
-                        self.initialValues[objName] = 1
-                    else:
-                        try:
-                            self.initialValues[objName] = initialValues[objName]
-                        except KeyError:
-                            self.initialValues[objName] = self.initialData.loc[(slice(None),slice(None),slice(None)),self.objectiveTypes[objName][1]].values.sum()
-                except NameError:
-                    pass
-            elif self.objectiveTypes[objName][4] == "areaWeightedSum":
-                for year in self.years:
-                        if not "Relative_" in self.objectiveTypes[objName][1]:
-                            self.solver.Add(self.objectivesByYear[(objName,year)] ==
-                            sum(self.decisionFrame["Decision"].values*
-                                            (self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][1]].values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].values))/self.sampleRatio,
-                            name="constraintfor"+objName+"InYear"+str(year))
-                        else:
-                            self.solver.Add(self.objectivesByYear[(objName,year)] ==
-                            sum(self.decisionFrame["Decision"].values*
-                                            (self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][1]].values*self.data.loc[(slice(None),year,slice(None)),self.areaCol].values)),
-                            name="constraintfor"+objName+"InYear"+str(year))
-  
+            if self.objectiveTypes[objName][4] in ["sum","areaWeightedAverage","areaWeightedSum","subsetSum"]:
+                if objName not in foldedObjectives:
+                    aggregate = self.aggregateVariables(self.objectiveTypes[objName][1],self.objectiveTypes[objName][4],self.objectiveTypes[objName][-1])
+                    for year in self.years:
+                        self.objectivesByYear[(objName,year)] = aggregate[year]
                 try:
                     if "Relative_" in self.objectiveTypes[objName][1]:
                         self.initialValues[objName] = 1
@@ -355,31 +1347,12 @@ class MultiFunctionalOptimization:
                         try:
                             self.initialValues[objName] = initialValues[objName]
                         except KeyError:
-                            self.initialValues[objName] = self.initialData.loc[(slice(None),slice(None),slice(None)),self.objectiveTypes[objName][1]].values.sum()
+                            self.initialValues[objName] = self.initialTotal(self.objectiveTypes[objName][1])
                 except NameError:
                     pass
-            elif self.objectiveTypes[objName][4] == "subsetSum":
+            else:
                 for year in self.years:
-                    if not "Relative_" in self.objectiveTypes[objName][1]:
-                        self.solver.Add(self.objectivesByYear[(objName,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                (self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][1]].values*self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][-1]].values))/self.sampleRatio,
-                                name="constraintfor"+objName+"InYear"+str(year))
-                    else:
-                        self.solver.Add(self.objectivesByYear[(objName,year)] ==
-                                sum(self.decisionFrame["Decision"].values*
-                                                (self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][1]].values*self.data.loc[(slice(None),year,slice(None)),self.objectiveTypes[objName][-1]].values)),
-                                name="constraintfor"+objName+"InYear"+str(year))
-                try:
-                    if "Relative_" in self.objectiveTypes[objName][1]:
-                        self.initialValues[objName] = 1
-                    else:
-                        try:
-                            self.initialValues[objName] = initialValues[objName]
-                        except KeyError:
-                            self.initialValues[objName] = self.initialData.loc[(slice(None),slice(None),slice(None)),self.objectiveTypes[objName][1]].values.sum()
-                except NameError:
-                    pass           
+                    self.objectivesByYear[(objName,year)] = self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),objName+"year"+str(year))
 
         self.objective = {
             objShortName:self.solver.NumVar(-self.solver.infinity(),self.solver.infinity(),objShortName)
@@ -389,7 +1362,16 @@ class MultiFunctionalOptimization:
         display("Aggregating year wise")
         # Year wise aggregation
         for objName in tqdm(self.objectiveTypes.keys(),file=sys.stdout):
-            if self.objectiveTypes[objName][3] == "min":
+            if objName in foldedObjectives:
+                weights = self.yearWiseWeights(self.objectiveTypes[objName][3])
+                key = self.aggregateKey(self.objectiveTypes[objName][1],self.objectiveTypes[objName][4],self.objectiveTypes[objName][-1])
+                if key in self.aggregates:
+                    #Variables by year exist already for other objectives
+                    self.solver.Add(self.objective[objName]==sum([weight*self.aggregates[key][year] for weight,year in zip(weights,self.years) if weight != 0]))
+                else:
+                    coefficients = weights @ self.standWiseCoefficients(*key)
+                    self.addAggregationRows([self.objective[objName]],coefficients[np.newaxis,:],["constraintfor"+objName])
+            elif self.objectiveTypes[objName][3] == "min":
                 for year in self.years:
                     self.solver.Add(self.objective[objName]<=self.objectivesByYear[(objName,year)])
             elif self.objectiveTypes[objName][3] == "max":
@@ -442,11 +1424,13 @@ class MultiFunctionalOptimization:
 
     def defineObjectives(self,objectiveTypes,initialValues=dict()):
 
-        self.regimesDecision = {(standId,regime):
-                   self.solver.NumVar(0,1,"treatmentDecisionForStand"+str(standId)+"Regime"+regime) 
-                   for (standId,regime) in itertools.product(self.standIds,self.regimes) if (standId,self.years[0],regime) in self.data.index}
-        for standId in self.standIds:
-            self.solver.Add(sum([self.regimesDecision[(standId,regime)] for regime in self.regimes if (standId,self.years[0],regime) in self.data.index])==1,name = "regimeConstraintForStand"+str(standId))
+        self.aggregates = dict()
+        self.regimesDecision = dict()
+        for i,standId in enumerate(self.standIds):
+            regimeConstraint = self.solver.Constraint(1,1,"regimeConstraintForStand"+str(standId))
+            for regime in self.regimes[self.availableRegimeIndices[self.availableRegimePointers[i]:self.availableRegimePointers[i+1]]]:
+                self.regimesDecision[(standId,regime)] = self.solver.NumVar(0,1,"treatmentDecisionForStand"+str(standId)+"Regime"+regime)
+                regimeConstraint.SetCoefficient(self.regimesDecision[(standId,regime)],1)
         if len(objectiveTypes) > 0:
             self.addObjectives(objectiveTypes,initialValues)
         else:
@@ -467,10 +1451,11 @@ class MultiFunctionalOptimization:
         self.globiomConstraint = dict()
         for source in sources:
             self.globiomConstraint[source] = dict()
+            aggregate = self.aggregateVariables(source,relative=False)
             for year in self.years:
                 targets = transferRates[source].keys()
-                self.globiomConstraint[source][year] = self.solver.Add(sum(self.globiomProduction[source][year][target] for target in targets) 
-                == sum(self.decisionFrame["Decision"].values*self.data.loc[(slice(None),year,slice(None)),source].sort_index().values)/self.sampleRatio,
+                self.globiomConstraint[source][year] = self.solver.Add(sum(self.globiomProduction[source][year][target] for target in targets)
+                == aggregate[year],
                 name = "GlobiomConstraintforsource"+source+"InYear"+str(year))
         targets = targetDict.keys()
         for target in targets:
@@ -508,8 +1493,124 @@ class MultiFunctionalOptimization:
                     self.solver.Add(self.objective["GlobiomSecondaryUsageof"+source+"as"+target] == sum(self.globiomProduction[source][year][target] for year in self.years),
                         name="GlobiomSecondaryUsageConstraintof"+source+"as"+target)
 
-    def calculateObjectiveRanges(self,debug=False):
+    def conditioningReport(self):
+        """Smallest and largest absolute nonzero coefficients of the model, and their ratio in orders of magnitude."""
+        proto = linear_solver_pb2.MPModelProto()
+        self.solver.ExportModelToProto(proto)
+        matrix = np.abs(np.concatenate([np.asarray(constraint.coefficient) for constraint in proto.constraint]+[np.zeros(0)]))
+        objective = np.abs(np.array([variable.objective_coefficient for variable in proto.variable]))
+        bounds = np.abs(np.array([bound for constraint in proto.constraint for bound in (constraint.lower_bound,constraint.upper_bound)]
+                                 +[bound for variable in proto.variable for bound in (variable.lower_bound,variable.upper_bound)]))
+        report = dict()
+        for name,values in [("matrix",matrix),("objective",objective),("bounds",bounds)]:
+            values = values[(values > 0) & np.isfinite(values) & (values < self.solver.infinity())]
+            if len(values) > 0:
+                report[name] = {"min":values.min(),"max":values.max(),"orders of magnitude":np.log10(values.max()/values.min())}
+        return pd.DataFrame(report).T
+
+    def startSolveSession(self,warmStart=None):
+        """Start a new solve log. With warmStart the solves reuse the basis of the previous solve,
+        otherwise each solve starts from scratch. Only GLOP reuses the basis, and does so by
+        default (see SolverConfig.warmStartBackends)."""
+        self.warmStart = self.solverConfig.warmStarts(warmStart)
+        self.solveLog = []
+        self.solvedStructure = None
+
+    def solve(self,label=""):
+        """Solve the problem, showing the conditioning report first if self.reportConditioning is set.
+
+        The basis of the previous solve is reused if self.warmStart is set and no variables or
+        constraints have been added since. Each solve is recorded in self.solveLog.
+        """
+        if self.reportConditioning:
+            display(self.conditioningReport())
+        structure = (self.solver.NumVariables(),self.solver.NumConstraints())
+        warmStart = self.warmStart and structure == self.solvedStructure
+        now = datetime.now()
+        res,iterations = self.solverConfig.solve(self.solver,self.warmStart)
+        self.solvedStructure = structure
+        self.solveLog.append({"label":label,"status":res,"iterations":iterations,
+                              "seconds":(datetime.now()-now).total_seconds(),"warmStart":warmStart})
+        if not np.isnan(iterations):
+            display(str(iterations)+" iterations"+(" from the previous basis" if warmStart else ""))
+        return res
+
+    def solveInWorkers(self,tasks,labels,workers=None):
+        """Solve tasks (see solveWorkerModel) on copies of the model in worker processes.
+
+        The model is serialized once and loaded once in each worker, and with
+        warm starts the solves of a worker continue from its previous basis.
+        Returns the results in the order of tasks and adds them to self.solveLog.
+        """
+        model = self.serializedModel()
+        workers = parallelWorkers(workers,len(tasks),len(model))
+        display("Solving "+str(len(tasks))+" problems in "+str(workers)+" processes")
+        with self.workerPool(model,workers) as pool:
+            results = list(tqdm(pool.map(solveWorkerModel,tasks),total=len(tasks),file=sys.stdout))
+        for label,result in zip(labels,results):
+            self.logSolve(label,result)
+        return results
+
+    def serializedModel(self):
+        proto = linear_solver_pb2.MPModelProto()
+        self.solver.ExportModelToProto(proto)
+        return proto.SerializeToString()
+
+    def workerPool(self,model,workers):
+        """Process pool whose workers have model loaded in a solver with the solver parameters."""
+        return ProcessPoolExecutor(max_workers=workers,initializer=loadWorkerModel,initargs=(self.solverConfig,model,self.warmStart))
+
+    def logSolve(self,label,result):
+        self.solveLog.append({"label":label,**{key:result[key] for key in ["status","iterations","seconds","warmStart"]}})
+
+    def solveResult(self,label=""):
+        """Solve the problem and return the status, iterations, time and warm start use."""
+        self.solve(label)
+        return dict(self.solveLog[-1])
+
+    def solveReport(self):
+        """Status, iterations, solution time and warm start use of the solves in this session."""
+        report = pd.DataFrame(self.solveLog,columns=["label","status","iterations","seconds","warmStart"])
+        report["status"] = report["status"].map(lambda status: solveStatusNames.get(status,str(status)))
+        return report
+
+    def rangeObjective(self,objName):
+        """Objective function coefficients {variable: coefficient} for optimizing objName alone."""
+        multiplier = 1 if self.objectiveTypes[objName][2] == "max" else -1
+        coefficients = dict()
+        for objName2 in self.objectiveTypes.keys():
+            if objName == objName2:
+                coefficients[self.objective[objName2]] = multiplier
+            else:
+                # If ranges already calculated also add the other objectives with small coefficients to improve ranges:
+                try:
+                    coefficients[self.objective[objName2]] = multiplier*1e-6/(self.objectiveRanges[objName2][1]-self.objectiveRanges[objName2][0])
+                except AttributeError:
+                    coefficients[self.objective[objName2]] = 0
+        return coefficients
+
+    def displaySolveStatus(self,res):
+        display("Could not solve")
+        if res == self.solver.FIXED_VALUE:
+            display("Objective value fixed")
+        if res == self.solver.INFEASIBLE:
+            display("Problem is infeasible")
+        if res == self.solver.ABNORMAL:
+            display("Something strange in the problem")
+        if res == self.solver.NOT_SOLVED:
+            display("Problem could not be solved for some reason")
+
+    def calculateObjectiveRanges(self,debug=False,parallel=False,workers=None):
+        """Payoff table of the objectives: each objective is optimized alone, and the
+        smallest and largest values of all objectives are stored in self.objectiveRanges.
+
+        With parallel the objectives are optimized in at most workers processes
+        (os.cpu_count() by default), capped by the available memory.
+        """
         self.debug=debug
+        if parallel:
+            self.objectiveRanges = self.calculateObjectiveRangesInWorkers(workers)
+            return
         lb = {objName:np.inf for objName  in self.objectiveTypes.keys()}
         ub = {objName:-np.inf for objName  in self.objectiveTypes.keys()}
         
@@ -518,19 +1619,8 @@ class MultiFunctionalOptimization:
             self.objectiveFunction = self.solver.Objective()
             display("Optimizing for "+self.objectiveTypes[objName][0])
             self.objectiveFunction.SetMaximization()
-            if self.objectiveTypes[objName][2] == "max":
-                multiplier = 1
-            elif self.objectiveTypes[objName][2] == "min":
-                multiplier = -1
-            for objName2 in self.objectiveTypes.keys():
-                if objName == objName2:
-                    self.objectiveFunction.SetCoefficient(self.objective[objName2],multiplier)
-                else:
-                    # If ranges already calculated also add the other objectives with small coefficients to improve ranges:
-                    try:
-                        self.objectiveFunction.SetCoefficient(self.objective[objName2],multiplier*1e-6/(self.objectiveRanges[objName2][1]-self.objectiveRanges[objName2][0]))
-                    except AttributeError:
-                        self.objectiveFunction.SetCoefficient(self.objective[objName2],0)                        
+            for variable,coefficient in self.rangeObjective(objName).items():
+                self.objectiveFunction.SetCoefficient(variable,coefficient)
             #If we have already been running the GUI, then we need to remove maxDummy from objective function
             try:
                 self.objectiveFunction.SetCoefficient(self.maxDummy,0)
@@ -540,7 +1630,7 @@ class MultiFunctionalOptimization:
                 problem = self.solver.ExportModelAsLpFormat(obfuscated=False)
                 print(problem,file=open("problem.lp","w"))
             now = datetime.now()
-            res = self.solver.Solve()
+            res = self.solve("Range for "+objName)
             time = datetime.now() - now 
             self.solutionTimeStamp = str(now).replace(":"," ")
             if res == self.solver.OPTIMAL:
@@ -553,18 +1643,40 @@ class MultiFunctionalOptimization:
                     if self.objective[objName].solution_value() < lb[objName]:
                         lb[objName] = self.objective[objName].solution_value()
             else:
-                display("Could not solve")
-                if res == self.solver.FIXED_VALUE:
-                    display("Objective value fixed")
-                if res == self.solver.INFEASIBLE:
-                    display("Problem is infeasible")
-                if res == self.solver.ABNORMAL:
-                    display("Something strange in the problem")
-                if res == self.solver.NOT_SOLVED:
-                    display("Problem could not be solved for some reason")            
+                self.displaySolveStatus(res)
         self.objectiveRanges = {objName: (lb[objName],ub[objName]) for objName in self.objectiveTypes.keys()}           
 
 
+    def calculateObjectiveRangesInWorkers(self,workers=None):
+        """Objective ranges from the single objective problems solved in worker processes."""
+        objNames = list(self.objectiveTypes.keys())
+        lb = {objName:np.inf for objName in objNames}
+        ub = {objName:-np.inf for objName in objNames}
+        display("Calculating objective ranges")
+        now = datetime.now()
+        self.solutionTimeStamp = str(now).replace(":"," ")
+        tasks = [{"objective":{variable.index():coefficient for variable,coefficient in self.rangeObjective(objName).items()},
+                  "maximize":True,"values":[self.objective[objName2].index() for objName2 in objNames]}
+                 for objName in objNames]
+        results = self.solveInWorkers(tasks,["Range for "+objName for objName in objNames],workers)
+        for objName,result in zip(objNames,results):
+            display("Optimizing for "+self.objectiveTypes[objName][0])
+            if result["status"] == self.solver.OPTIMAL:
+                display("Found an optimal solution in "+str(int(result["seconds"]))+" seconds")
+                for objName2,value in zip(objNames,result["values"]):
+                    ub[objName2] = max(ub[objName2],value)
+                    lb[objName2] = min(lb[objName2],value)
+            else:
+                self.displaySolveStatus(result["status"])
+        display("Calculated objective ranges in "+str((datetime.now()-now).seconds)+" seconds")
+        #The GUI continues from the objective of the last objective, as after the serial calculation
+        self.objectiveFunction = self.solver.Objective()
+        self.objectiveFunction.Clear()
+        self.objectiveFunction.SetMaximization()
+        for variable,coefficient in self.rangeObjective(objNames[-1]).items():
+            self.objectiveFunction.SetCoefficient(variable,coefficient)
+        return {objName: (lb[objName],ub[objName]) for objName in objNames}
+
     def defineEpsilonConstraint(self,**kwargs):
         try:
             for objName in self.objectiveTypes.keys():
@@ -583,28 +1695,36 @@ class MultiFunctionalOptimization:
             elif self.objectiveTypes[objName][2] == "min":
                 self.epsilonConstraints[objName].SetUb(epsilonValues[objName])
 
+    def referencePointTask(self,referencePoint):
+        """Changes of the achievement problem for referencePoint {objName: value}, in the task
+        format of solveWorkerModel. The values of the objectives are reported."""
+        coefficients = dict()
+        bounds = dict()
+        objective = dict()
+        for objName in self.objectiveTypes.keys():
+            constraint = self.maxDummyConstraints[objName].index()
+            variable = self.objective[objName].index()
+            objRange = self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0]
+            multiplier = 1 if self.objectiveTypes[objName][2] == "max" else -1
+            coefficients[(constraint,self.maxDummy.index())] = 1
+            coefficients[(constraint,variable)] = -multiplier/objRange
+            bounds[constraint] = (-self.solver.infinity(),-multiplier*referencePoint[objName]/objRange)
+            objective[variable] = multiplier*10**(-6)/objRange
+        objective[self.maxDummy.index()] = 1
+        return {"coefficients":coefficients,"bounds":bounds,"objective":objective,"maximize":True,
+                "values":[self.objective[objName].index() for objName in self.objectiveTypes.keys()]}
+
     def defineReferencePointAndSolve(self,**kwargs):
         display("Starting problem solving at "+str(datetime.now()))
         self.solutionCounter +=1
         referencePoint = kwargs
-        for objName in self.objectiveTypes.keys():
-            self.maxDummyConstraints[objName].SetCoefficient(self.maxDummy,1)
-            if self.objectiveTypes[objName][2] == "max":
-                self.maxDummyConstraints[objName].SetCoefficient(self.objective[objName],-1/(self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0]))
-                self.maxDummyConstraints[objName].SetUb(-referencePoint[objName]/(self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0]))
-                self.objectiveFunction.SetCoefficient(self.objective[objName],10**(-6)/(self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0]))
-            elif self.objectiveTypes[objName][2] == "min":
-                self.maxDummyConstraints[objName].SetCoefficient(self.objective[objName],1/(self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0]))
-                self.maxDummyConstraints[objName].SetUb(referencePoint[objName]/(self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0]))
-                self.objectiveFunction.SetCoefficient(self.objective[objName],-10**(-6)/(self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0]))
-
-        self.objectiveFunction.SetCoefficient(self.maxDummy,1)
+        applyModelChanges(self.solver,self.referencePointTask(referencePoint))
         if self.debug:
             problem = self.solver.ExportModelAsLpFormat(obfuscated=False)
             print(problem,file=open("problem.lp","w"))
             display("Problem exported at "+str(datetime.now()))
         now = datetime.now()
-        res = self.solver.Solve()
+        res = self.solve("Reference point "+str(self.solutionCounter))
         time = datetime.now() - now
         display("Problem solved at "+str(datetime.now()))
         self.solutionTimeStamp = str(now).replace(":"," ")
@@ -630,20 +1750,188 @@ class MultiFunctionalOptimization:
             if res == self.solver.NOT_SOLVED:
                 display("Problem could not be solved for some reason")      
 
+    def sweepReferencePoints(self,referencePoints=None,grid=None,samples=None,objNames=None,fixed=dict(),
+                             maxPoints=10**5,seed=18052021,parallel=True,workers=None):
+        """Solve a batch of reference points with the current epsilon and enabled constraints.
+
+        referencePoints is a DataFrame or a list of dicts with a value for each objective.
+        Instead, grid gives a grid with that many values of each objective in objNames (all
+        objectives by default), or samples a Latin hypercube sample of that many points,
+        within self.objectiveRanges. The other objectives are fixed at their values in fixed,
+        or in the middle of their ranges. More than maxPoints points raise a ValueError.
+        With parallel the points are solved in worker processes and the problem of the
+        GUI is not changed. Returns a DataFrame with the reference point (Reference_ columns),
+        the objective values, solve status, iterations and solution time of each point.
+        """
+        allObjNames = list(self.objectiveTypes.keys())
+        if objNames is None:
+            objNames = allObjNames
+        lb = np.array([self.objectiveRanges[objName][0] for objName in objNames])
+        ub = np.array([self.objectiveRanges[objName][1] for objName in objNames])
+        if referencePoints is not None:
+            points = pd.DataFrame(referencePoints)[allObjNames]
+        else:
+            if grid is not None:
+                if grid**len(objNames) > maxPoints:
+                    raise ValueError("A grid of "+str(grid)+" values of "+str(len(objNames))+" objectives has "+str(grid**len(objNames))
+                                     +" points, more than maxPoints="+str(maxPoints)+". Choose fewer objectives with objNames or use samples")
+                axes = np.meshgrid(*[np.linspace(lb[i],ub[i],grid) for i in range(len(objNames))],indexing="ij")
+                values = np.stack(axes,axis=-1).reshape(-1,len(objNames))
+            elif samples is not None:
+                if samples > maxPoints:
+                    raise ValueError(str(samples)+" samples are more than maxPoints="+str(maxPoints))
+                rng = np.random.default_rng(seed)
+                strata = np.stack([rng.permutation(samples) for objName in objNames],axis=1)
+                values = lb+(strata+rng.random((samples,len(objNames))))/samples*(ub-lb)
+            else:
+                raise ValueError("Give referencePoints, grid or samples")
+            points = pd.DataFrame(values,columns=objNames)
+            for objName in allObjNames:
+                if objName not in objNames:
+                    points[objName] = fixed.get(objName,sum(self.objectiveRanges[objName])/2)
+            points = points[allObjNames]
+        if len(points) > maxPoints:
+            raise ValueError(str(len(points))+" reference points are more than maxPoints="+str(maxPoints))
+        points = points.to_numpy(dtype=float)
+        tasks = [self.referencePointTask(dict(zip(allObjNames,point))) for point in points]
+        labels = ["Sweep point "+str(i) for i in range(len(tasks))]
+        if parallel:
+            results = self.solveInWorkers(tasks,labels,workers)
+        else:
+            results = []
+            for task,label in zip(tqdm(tasks,file=sys.stdout),labels):
+                applyModelChanges(self.solver,task)
+                result = self.solveResult(label)
+                result["values"] = solutionValues(self.solver,task["values"],result["status"])
+                results.append(result)
+        sweep = pd.DataFrame(points,columns=["Reference_"+objName for objName in allObjNames])
+        values = np.array([result["values"] if result["values"] is not None else [np.nan]*len(allObjNames) for result in results])
+        for i,objName in enumerate(allObjNames):
+            sweep[objName] = values[:,i]
+        sweep["status"] = [solveStatusNames.get(result["status"],str(result["status"])) for result in results]
+        sweep["iterations"] = [result["iterations"] for result in results]
+        sweep["seconds"] = [result["seconds"] for result in results]
+        return sweep
+
+    def paretoFront(self,objNames,points=10,parallel=True,workers=None):
+        """Pareto optimal solutions of the objectives objNames with the epsilon constraint method (AUGMECON2).
+
+        The first objective is optimized and the others are bounded with their epsilon
+        constraints, at points values (a number, or a list with a number for each bounded
+        objective) from the worst to the best value of self.objectiveRanges. The slacks of
+        the bounded objectives are added to the objective with small weights, so that the
+        solutions are not weakly dominated. Grid points within the slack of a solution are
+        skipped, and a chain of points stops at its first infeasible point, as do the
+        chains with tighter bounds. The other epsilon constraints stay as set in the GUI.
+        With parallel the chains are solved in worker processes.
+        Returns a DataFrame with the bounds (Epsilon_ columns), objective values, status,
+        iterations and solution time of the solved points, including the infeasible
+        points where the chains stopped.
+        """
+        objNames = list(objNames)
+        if len(objNames) < 2:
+            raise ValueError("A Pareto front needs at least two objectives, got "+str(objNames))
+        missing = [objName for objName in objNames if objName not in getattr(self,"objectiveRanges",dict())]
+        if len(missing) > 0:
+            raise ValueError("No objective ranges for "+str(missing)+", define the objectives and calculate their ranges first")
+        self.defineEpsilonConstraint()
+        primary,bounded = objNames[0],objNames[1:]
+        if np.isscalar(points):
+            points = [points]*len(bounded)
+        if len(points) != len(bounded):
+            raise ValueError("points has "+str(len(points))+" values for "+str(len(bounded))+" bounded objectives")
+        senses = {objName:1 if self.objectiveTypes[objName][2] == "max" else -1 for objName in objNames}
+        ranges = {objName:self.objectiveRanges[objName][1]-self.objectiveRanges[objName][0] for objName in objNames}
+        grids = dict()
+        steps = dict()
+        objective = {self.objective[primary].index():senses[primary]}
+        for k,(objName,n) in enumerate(zip(bounded,points)):
+            grid = np.linspace(self.objectiveRanges[objName][0],self.objectiveRanges[objName][1],n)
+            grids[objName] = grid if senses[objName] > 0 else grid[::-1]
+            steps[objName] = ranges[objName]/(n-1) if n > 1 else 0
+            objective[self.objective[objName].index()] = senses[objName]*10**(-3-k)/(ranges[objName] if ranges[objName] > 0 else 1)
+        inner,outer = bounded[0],bounded[1:]
+        outerShape = [len(grids[objName]) for objName in outer]
+        chunks = 1
+        if parallel:
+            model = self.serializedModel()
+            workers = parallelWorkers(workers,int(np.prod(outerShape))*len(grids[inner]),len(model))
+            chunks = max(1,min(len(grids[inner]),workers//int(np.prod(outerShape))))
+        #The inner grid is split in chunks so that also two objective fronts are solved in parallel
+        innerChunks = np.array_split(np.arange(len(grids[inner])),chunks)
+        allObjNames = list(self.objectiveTypes.keys())
+        keys = [outerIndex+(chunk,) for outerIndex in np.ndindex(*outerShape) for chunk in range(chunks)]
+        chains = dict()
+        for key in keys:
+            chains[key] = {"objective":objective,"maximize":True,
+                           "bounds":{self.epsilonConstraints[objName].index():(grids[objName][j],self.solver.infinity()) if senses[objName] > 0
+                                     else (-self.solver.infinity(),grids[objName][j]) for objName,j in zip(outer,key[:-1])},
+                           "row":self.epsilonConstraints[inner].index(),"variable":self.objective[inner].index(),
+                           "sense":senses[inner],"grid":list(grids[inner][innerChunks[key[-1]]]),"step":steps[inner],
+                           "values":[self.objective[objName].index() for objName in allObjNames],
+                           "label":"Pareto chain "+str(key)}
+        # A chain infeasible at its first point makes the chains with tighter bounds infeasible too
+        def dominated(key,infeasible):
+            return any(all(k >= f for k,f in zip(key,infeasibleKey)) for infeasibleKey in infeasible)
+        results = dict()
+        infeasible = []
+        if parallel:
+            display("Solving "+str(len(keys))+" chains of epsilon constraints in "+str(workers)+" processes")
+            with self.workerPool(model,min(workers,len(keys))) as pool:
+                futures = {pool.submit(solveEpsilonChain,chains[key]):key for key in keys}
+                for future in tqdm(as_completed(futures),total=len(futures),file=sys.stdout):
+                    if future.cancelled():
+                        continue
+                    key = futures[future]
+                    results[key] = future.result()
+                    for result in results[key]:
+                        self.logSolve(result["label"],result)
+                    if results[key][0]["values"] is None:
+                        infeasible.append(key)
+                        for otherFuture,otherKey in futures.items():
+                            if dominated(otherKey,[key]):
+                                otherFuture.cancel()
+        else:
+            bounds = {objName:(self.epsilonConstraints[objName].lb(),self.epsilonConstraints[objName].ub()) for objName in bounded}
+            for key in tqdm(keys,file=sys.stdout):
+                if dominated(key,infeasible):
+                    continue
+                results[key] = epsilonChain(self.solver,self.solveResult,chains[key])
+                if results[key][0]["values"] is None:
+                    infeasible.append(key)
+            for objName,(lb,ub) in bounds.items():
+                self.epsilonConstraints[objName].SetBounds(lb,ub)
+        rows = []
+        for key in keys:
+            for result in results.get(key,[]):
+                row = {"Epsilon_"+inner:result["epsilon"]}
+                row.update({"Epsilon_"+objName:grids[objName][j] for objName,j in zip(outer,key[:-1])})
+                row.update(zip(allObjNames,result["values"] if result["values"] is not None else [np.nan]*len(allObjNames)))
+                row.update(status=solveStatusNames.get(result["status"],str(result["status"])),
+                           iterations=result["iterations"],seconds=result["seconds"])
+                rows.append(row)
+        display("Solved "+str(len(rows))+" problems for "+str(int(np.prod([len(grid) for grid in grids.values()])))+" grid points")
+        return pd.DataFrame(rows)
+
     def enableAndDisableConstraints(self,**kwargs):
         enabledConstraints = kwargs
+        #A decision can be bounded by several allowed regimes constraints, so the bounds are
+        #first released and then set to zero for the enabled constraints
+        allowedRegimes = [constraintName for constraintName in self.constraints.keys()
+                          if self.constraintTypes[constraintName][0] == "Allowed regimes"]
+        for enabled in [False,True]:
+            for constraintName in allowedRegimes:
+                if bool(enabledConstraints[constraintName]) == enabled:
+                    for decision in self.constraints[constraintName].values():
+                        decision.SetUb(1-enabled)
+        #Disabled rows are free rows, which the solvers drop in presolve
         for constraintName in self.constraints.keys():
-            if self.constraintTypes[constraintName][0] == "Allowed regimes":
-                for regime in self.regimes:
-                    if regime not in self.constraintTypes[constraintName][2]:
-                        for standId in self.standIds:
-                            if (standId,regime) in self.regimesDecision.keys() and self.data.loc[(standId,self.years[0],regime),self.constraintTypes[constraintName][3]] == 1:
-                                self.constraints[constraintName][(standId,regime)].SetUb(1-(enabledConstraints[constraintName]))
             if self.constraintTypes[constraintName][0] == "Species reduction":
-                periodNo = self.constraintTypes[constraintName][3]
-                for i,year in enumerate(self.years):
-                    if i >= periodNo:
-                        self.constraints[constraintName][year].SetLb((-1+enabledConstraints[constraintName])*1e10)
+                for constraint in self.constraints[constraintName].values():
+                    constraint.SetLb(0 if enabledConstraints[constraintName] else -self.solver.infinity())
+            if self.constraintTypes[constraintName][0] == "less than":
+                for constraint in self.constraints[constraintName].values():
+                    constraint.SetUb(0 if enabledConstraints[constraintName] else self.solver.infinity())
 
     def printSolution(self,_):
         import os
@@ -736,7 +2024,7 @@ class MultiFunctionalOptimization:
                 problem = self.solver.ExportModelAsLpFormat(obfuscated=False)
                 print(problem,file=open("problem.lp","w"))
             now = datetime.now()
-            res = self.solver.Solve()
+            res = self.solve("Range for "+objName)
             time = datetime.now() - now 
             self.solutionTimeStamp = str(now).replace(":"," ")
             if res == self.solver.OPTIMAL:
@@ -767,7 +2055,7 @@ class MultiFunctionalOptimization:
         for objName2 in self.eyvindsonObjectives.keys():
             self.objectiveFunction.SetCoefficient(self.eyvindsonObjectives[objName2],multiplier/(self.objectiveRangesEY[objName2][1]-self.objectiveRangesEY[objName2][0])) #MAYBE need to objective - minimum to properly normalize in objective function
         now = datetime.now()
-        res = self.solver.Solve()
+        res = self.solve("Multifunctionality")
         time = datetime.now() - now
         
         if res == self.solver.OPTIMAL:
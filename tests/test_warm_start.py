@@ -0,0 +1,108 @@
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),"..","py_class"))
+import multiFunctionalOptimization as MFO
+
+
+def writeData(filename,nstands=300,seed=1):
+    """Simulated data of nstands stands with five regimes and seven periods."""
+    rng = np.random.default_rng(seed)
+    regimes = ["BAU","CCF_1","CCF_3","SA","BAUwT_B"]
+    years = list(range(2016,2016+5*7,5))
+    rows = []
+    for stand in range(1,nstands+1):
+        area = rng.uniform(5,50)
+        peat = int(rng.random() < 0.3)
+        available = [regime for regime in regimes if rng.random() < 0.85] or ["BAU"]
+        def indicators():
+            return dict(i_Vm3=rng.uniform(0,10),Harvested_V=rng.uniform(0,5)*(rng.random() < 0.4),
+                        Biomass=rng.uniform(0,2)*(rng.random() < 0.3),BILBERRY=rng.uniform(0,3),
+                        V_total_deadwood=rng.uniform(0,20),V=rng.uniform(50,300),prc_V_deciduous=rng.uniform(0,1))
+        rows.append(dict(id=stand,year=years[0],regime="initial_state",represented_area_by_NFIplot=area,PEAT=peat,**indicators()))
+        for regime in available:
+            for year in years[1:]:
+                rows.append(dict(id=stand,year=year,regime=regime,represented_area_by_NFIplot=area,PEAT=peat,**indicators()))
+    pd.DataFrame(rows).to_csv(filename,sep=";",index=False)
+
+
+@pytest.fixture(scope="module")
+def dataFile(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("data")/"data.csv")
+    writeData(filename)
+    return filename
+
+
+def buildModel(filename,backend,warmStart=None,incremental=False):
+    """Model with objective ranges. incremental makes all solves incremental, also where warmStart is refused."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        mfo = MFO.MultiFunctionalOptimization(backend)
+        mfo.startSolveSession(warmStart)
+        if incremental:
+            mfo.warmStart = True
+        mfo.readData(filename,useCache=False)
+        mfo.calculateTotalValuesFromRelativeValues(
+            columnTypes={colname:(float,"Relative to Area") for colname in ["i_Vm3","Harvested_V","Biomass","BILBERRY","V_total_deadwood"]})
+        mfo.addRegimeClassifications(regimeClassNames={"regimeClass0name":"CCF"},
+                                     regimeClassregimes={"regimeClass0regimes":["CCF_1","CCF_3"]})
+        mfo.finalizeData(initialRegime="initial_state")
+        mfo.defineObjectives({"Sum_i":["inc","Total_i_Vm3","max","average","sum"],
+                              "Harv":["harv","Harvested_V","max","min","areaWeightedAverage"],
+                              "Dead":["dead","V_total_deadwood","max","targetYear","areaWeightedAverage",2036],
+                              "CCF":["ccf","CCF_forests","max","firstYear","areaWeightedAverage"],
+                              "Bio":["bio","Total_Biomass","min","maxYearlyIncrease","sum"]})
+        mfo.calculateObjectiveRanges()
+    return mfo
+
+
+def referencePointErrors(mfo,points=12,seed=0):
+    """Differences of the reference point solves of mfo from solves of the same model by a new solver."""
+    rng = np.random.default_rng(seed)
+    errors = []
+    for _ in range(points):
+        referencePoint = {objName:low+(high-low)*rng.random() for objName,(low,high) in mfo.objectiveRanges.items()}
+        with contextlib.redirect_stdout(io.StringIO()):
+            mfo.defineReferencePointAndSolve(**referencePoint)
+        model = linear_solver_pb2.MPModelProto()
+        mfo.solver.ExportModelToProto(model)
+        solver = pywraplp.Solver.CreateSolver(mfo.solverConfig.backend)
+        solver.LoadModelFromProto(model)
+        assert solver.Solve() == pywraplp.Solver.OPTIMAL
+        errors.append(abs(mfo.solver.Objective().Value()-solver.Objective().Value()))
+    return np.array(errors)
+
+
+def test_clp_warm_start_is_refused():
+    config = MFO.SolverConfig("CLP")
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not config.warmStarts(True)
+    assert not config.warmStarts()
+    assert MFO.SolverConfig("GLOP").warmStarts()
+
+
+def test_incremental_clp_solves_return_wrong_optima(dataFile):
+    mfo = buildModel(dataFile,"CLP",incremental=True)
+    errors = referencePointErrors(mfo)
+    assert (errors > 1e-6).any(), "Incremental CLP solves match new solves, CLP warm starts could be allowed again"
+
+
+@pytest.mark.parametrize("backend,warmStart",[("CLP",None),("GLOP",True),("GLOP",False)])
+def test_solves_match_new_solver(dataFile,backend,warmStart):
+    mfo = buildModel(dataFile,backend,warmStart)
+    assert (referencePointErrors(mfo) <= 1e-6).all()
+
+
+def test_cold_glop_solves_start_from_scratch(dataFile):
+    iterations = dict()
+    for warmStart in [True,False]:
+        mfo = buildModel(dataFile,"GLOP",warmStart)
+        referencePointErrors(mfo,points=3)
+        iterations[warmStart] = mfo.solveReport()["iterations"].tolist()
+    assert iterations[True] != iterations[False]